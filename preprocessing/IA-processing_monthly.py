@@ -1,252 +1,287 @@
 import rasterio
-from rasterio.windows import Window
 import numpy as np
 import argparse
 import os
-from scipy.ndimage import label
 import time
-from scipy.ndimage import convolve
-from datetime import datetime
-from dateutil.relativedelta import relativedelta
-
-def modify_date_in_path(file_path,months):
-    # Split the path into directory and filename
-    dir_name, file_name = os.path.split(file_path)
-    
-    # Find the date in the filename
-    date_str = file_name.split('_')[2]
-    
-    # Parse the date
-    date = datetime.strptime(date_str, "%Y-%m-%d")
-    
-    # Subtract 12 months, properly handling leap years
-    new_date = date - relativedelta(months=months)
-    
-    # Format the new date
-    new_date_str = new_date.strftime("%Y-%m-%d")
-    
-    # Replace the old date with the new date in the filename
-    new_file_name = file_name.replace(date_str, new_date_str)
-    
-    # Combine the directory and new filename
-    new_file_path = os.path.join(dir_name, new_file_name)
-    
-    return new_file_path
-
-def weighted_smoothing(data, window_size):
-    # Create a weighted distance matrix
-    x, y = np.meshgrid(np.arange(window_size), np.arange(window_size))
-    distance = np.sqrt((x - window_size // 2)**2 + (y - window_size // 2)**2)
-    weight = 1.0 / (1.0 + distance**1.5)  # Weighted distance
-    threshold=np.quantile(weight,0.17)
-    weight[weight<threshold]=0
-    # Normalize the weights
-    weight /= weight.sum()
-
-    # Apply convolution with the weighted kernel
-    smoothed_data = convolve(np.nan_to_num(data), weight, mode='constant', cval=0.0)
-    return smoothed_data
-
-
-def aggregate_by_40_max(input_array,fun):
-    if fun=="max":
-        small = input_array.reshape([int(input_array.shape[1]//40), 40,int(input_array.shape[1]//40), 40]).max(3).max(1)
-    if fun=="min":
-        small = input_array.reshape([int(input_array.shape[1]//40), 40,int(input_array.shape[1]//40), 40]).min(3).min(1)
-    elif fun=="mean":
-        small = input_array.reshape([int(input_array.shape[1]//40), 40,int(input_array.shape[1]//40), 40]).mean(3).mean(1)
-    elif fun=="nanmean":
-        small = np.nan_to_num(np.nanmean(np.nanmean(input_array.reshape([int(input_array.shape[1]//40), 40,int(input_array.shape[1]//40), 40]),axis=3),axis=1))
-    elif fun=="sum":
-        small = input_array.reshape([int(input_array.shape[1]//40), 40,int(input_array.shape[1]//40), 40]).sum(3).sum(1)
-    return small
-
-def fun_patchiness(input_array):
-    output_array=np.zeros((input_array.shape[1]//40,input_array.shape[2]//40))
-    for x in range(0,output_array.shape[0]):
-        for y in range(0,output_array.shape[0]):
-            output_array[x,y]=label(input_array[0,(40*x):(40*x+40),(40*y):(40*y+40)])[1]
-    return output_array
-
-
-
-
-def process_geotiff(input_file, output_file,relative_date,num_windows,groundtruth1m_called,groundtruth3m_called,groundtruth6m_called,groundtruth12m_called):
-    # Open the GeoTIFF file
-    with rasterio.open(input_file) as src:
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import repeat
+from smoothing_engine import weighted_smoothing
+from ia_features import block_features_for_dates, gdal_cache_env, index_features, read_strip_features, window_block_features, layer_profile, strip_windows, DEFAULT_MEMORY_BUDGET, FEATURE_DTYPES, GROUNDTRUTH_MONTHS, BLOCK_SIZE
+from ia_profile import NO_TIMER, stage_timer
+from tile_dates import TileDate, parse_layer_path
+from ia_cache import block_occupancy, load_block_date_cache
+from tile_halo import neighbour_paths, read_mosaic_window
+from feature_cube import create_cube, cube_path, feature_dates, write_feature
+from rasterio.windows import Window
+
+# every output layer with the block features it is made of and its output dtype.
+# the groundtruth layers are counted at the current date and written to the earlier date they are the groundtruth of
+LAYERS = {
+    "timesinceloss": (["timesinceloss"], "uint16"),
+    "lastthreemonths": (["lastthreemonths"], "uint16"),
+    "lastsixmonths": (["lastsixmonths"], "uint16"),
+    "previoussameseason": (["previoussameseason"], "uint16"),
+    "totallossalerts": (["totallossalerts"], "uint16"),
+    "confidence": (["confidence"], "float32"),
+    "patchdensity": (["patchdensity"], "uint16"),
+    "smoothedtotal": (["totallossalerts"], "uint16"),
+    "smoothedsixmonths": (["lastsixmonths"], "uint16"),
+    "lastmonth": (["lastmonth"], "uint16"),
+    "groundtruth1m": (["groundtruth1m"], "uint16"),
+    "groundtruth3m": (["groundtruth3m"], "uint16"),
+    "groundtruth6m": (["groundtruth6m"], "uint16"),
+    "groundtruth12m": (["groundtruth12m"], "uint16"),
+}
+# the smoothed layers with the feature they smooth and the size of the smoothing window in blocks
+SMOOTHED_LAYERS = {"smoothedtotal": "totallossalerts", "smoothedsixmonths": "lastsixmonths"}
+SMOOTHING_WINDOW = 31
+# layers: every layer its own GeoTIFF, multiband: all layers of a tile and date in one float32 <tile>_<date>_features.tif,
+# cube: every layer in the zarr feature cube of the tile in the cube folder next to the input folder (see feature_cube.py)
+OUTPUT_FORMATS = ["layers", "multiband", "cube"]
+# GDAL compresses and writes without the GIL, so the layers are written by a few threads while the next ones are computed
+WRITE_THREADS = 4
+
+
+def layer_key(key,layer):
+    # the date a layer of the date of key is stored at: the groundtruth layers belong to the earlier date they are the groundtruth of
+    return key.shifted(-GROUNDTRUTH_MONTHS[layer]) if layer in GROUNDTRUTH_MONTHS else key
+
+
+def layer_paths(prep_folder,key,layers):
+    # the path of every given layer of one tile and date
+    return {layer:layer_key(key,layer).layer_path(prep_folder,layer) for layer in layers}
+
+
+def layers_to_create(prep_folder,key,groundtruth_called):
+    # returns the path of every layer of one date that does not exist yet
+    layers=[layer for layer in LAYERS if layer not in GROUNDTRUTH_MONTHS or groundtruth_called[layer]==1]
+    return {layer:layer_file for layer,layer_file in layer_paths(prep_folder,key,layers).items() if not os.path.isfile(layer_file)}
+
+
+def multiband_to_create(prep_folder,key,groundtruth_called):
+    # every layer of one date goes to the same file, the groundtruth bands hold the counts of this date
+    # that are the groundtruth of the earlier dates
+    features_file=key.layer_path(prep_folder,"features")
+    if os.path.isfile(features_file): return {}
+    return {layer:features_file for layer in LAYERS if groundtruth_called.get(layer,1)==1}
+
+
+def cube_file(prep_folder,key):
+    # the tiles of <prep_folder>/input have their cube in <prep_folder>/cube/<tile>.zarr
+    return cube_path(os.path.join(prep_folder,"cube"),key.tile)
+
+
+def cube_layers_to_create(prep_folder,key,groundtruth_called):
+    # returns the date at which every layer of one date is stored in the cube, for the layers the cube does not hold yet
+    path=cube_file(prep_folder,key)
+    layer_dates={}
+    for layer in LAYERS:
+        if layer in GROUNDTRUTH_MONTHS and groundtruth_called[layer]!=1: continue
+        layer_date=layer_key(key,layer).date_string
+        if layer_date not in feature_dates(path,layer): layer_dates[layer]=layer_date
+    return layer_dates
+
+
+def planned_to_create(prep_folder,key,layers,output_format,groundtruth_called):
+    # the layers that ia_planner.py planned for one date in the form of the output format: their files, the features
+    # file of the date with all its bands (it is always written whole) or the dates they are stored at in the cube
+    if not layers: return {}
+    if output_format=="multiband": return {layer:key.layer_path(prep_folder,"features") for layer in LAYERS if groundtruth_called.get(layer,1)==1}
+    if output_format=="cube": return {layer:layer_key(key,layer).date_string for layer in layers}
+    return layer_paths(prep_folder,key,layers)
+
+
+def write_layers(layer_file,layers,arrays,crs,transform):
+    # a single layer keeps its own dtype, several layers share a float32 file with the layer names as band descriptions
+    dtype=LAYERS[layers[0]][1] if len(layers)==1 else "float32"
+    with rasterio.open(layer_file, 'w', width=arrays[0].shape[1], height=arrays[0].shape[0], count=len(layers), dtype=dtype, crs=crs, transform=transform, **layer_profile(dtype)) as dst:
+        for band,(layer,array) in enumerate(zip(layers,arrays),start=1):
+            dst.write(array.astype(dtype),band)
+            if len(layers)>1: dst.set_band_description(band,layer)
+
+
+def halo_block_features(input_file,blocks,features,halo):
+    # pads the block features of every date with halo blocks on each side, computed from the edges of the
+    # neighbouring alert tiles. only the strips of the neighbours within the halo are read, blocks without a
+    # neighbouring tile stay zero like the zero padding of the smoothing itself
+    rows,cols=next(iter(next(iter(blocks.values())).values())).shape
+    padded={date:{feature:np.pad(blocks[date][feature],halo) for feature in date_features} for date,date_features in features.items()}
+    if not neighbour_paths(input_file): return padded
+    pixels=halo*40
+    # the four sides as (window in pixels of the tile, first padded row, first padded column)
+    sides=[(Window(-pixels,-pixels,cols*40+2*pixels,pixels),0,0),
+           (Window(-pixels,rows*40,cols*40+2*pixels,pixels),halo+rows,0),
+           (Window(-pixels,0,pixels,rows*40),halo,0),
+           (Window(cols*40,0,pixels,rows*40),halo,halo+cols)]
+    for window,first_row,first_col in sides:
+        data=read_mosaic_window(input_file,window)
+        if not data.any(): continue
+        for date,date_blocks in block_features_for_dates(data,list(features),features).items():
+            for feature,values in date_blocks.items():
+                padded[date][feature][first_row:first_row+values.shape[0],first_col:first_col+values.shape[1]]=values
+    return padded
+
+
+def layer_array(layer,blocks,halo_blocks=None):
+    # with halo blocks the smoothing also sees the alerts just across the tile border and is cropped afterwards
+    if layer in SMOOTHED_LAYERS:
+        if halo_blocks is None:
+            return weighted_smoothing(blocks[SMOOTHED_LAYERS[layer]], window_size=SMOOTHING_WINDOW, exponent=1.5, quantile=0.17)
+        halo=SMOOTHING_WINDOW//2
+        return weighted_smoothing(halo_blocks[SMOOTHED_LAYERS[layer]], window_size=SMOOTHING_WINDOW, exponent=1.5, quantile=0.17)[halo:-halo,halo:-halo]
+    return sum(blocks[feature] for feature in LAYERS[layer][0])
+
+
+def layer_stage(layer):
+    # the stage a layer is timed in once its block features are there
+    return "smoothing" if layer in SMOOTHED_LAYERS else "layers"
+
+
+def strip_features(src,windows,features,timer=NO_TIMER):
+    # reads the strips one by one into a reusable buffer and decodes every alert pixel once to derive all block features of all dates.
+    # yields the same (window, block features, stage seconds, peak memory) as the strip workers, those are already on the timer
+    buffer=None
+    for window in windows:
+        with timer.stage("read"):
+            if buffer is None or buffer.size<window.height*window.width: buffer=np.empty(window.height*window.width,dtype=src.dtypes[0])
+            data = src.read(1,window=window,out=buffer[:window.height*window.width].reshape(window.height,window.width))
+        yield window,window_block_features(data,features,timer=timer),None,None
+
+
+def timed(timer,stage,function,*args):
+    # runs a function under a stage of the timer, also in the writer threads
+    with timer.stage(stage):
+        return function(*args)
+
+
+def process_geotiff(input_file, output_file,relative_date,num_windows,groundtruth1m_called,groundtruth3m_called,groundtruth6m_called,groundtruth12m_called,memory_budget=DEFAULT_MEMORY_BUDGET,use_cache=False,halo=False,output_format="layers",write_threads=WRITE_THREADS,planned_layers=None,strip_workers=1,profile_log=None):
+    # relative_date can also be a list of relative dates, these are then all processed from a single read of the tile
+    # and the date in the name of output_file is replaced by each of them. with use_cache all features except
+    # patchdensity are looked up in the block date cache of the tile (see ia_cache.py) instead of reading it.
+    # with halo the smoothed layers include the alerts of the neighbouring tiles in the same folder (see tile_halo.py)
+    # output_format is one of OUTPUT_FORMATS. planned_layers maps every relative date to the layers to (re)create,
+    # as planned by ia_planner.py, in any output format instead of looking up which layers are missing. with
+    # strip_workers above 1 the strips are read and aggregated by that many worker processes, which share the memory
+    # budget. with a profile_log (or the IA_PROFILE_LOG environment variable) the seconds per stage are appended to
+    # that run log
+    relative_dates=list(relative_date) if isinstance(relative_date,(list,tuple)) else [relative_date]
+    groundtruth_called={"groundtruth1m":groundtruth1m_called,"groundtruth3m":groundtruth3m_called,"groundtruth6m":groundtruth6m_called,"groundtruth12m":groundtruth12m_called}
+    # Open the GeoTIFF file, with the GDAL block cache of this process capped at its share of the memory budget
+    with gdal_cache_env(memory_budget/strip_workers), rasterio.open(input_file) as src:
         newtransform=src.transform*src.transform.scale(40,40)
         # Get the dimensions of the raster
         width = src.width
         height = src.height
 
-
-        # Calculate the number of windows (4 equal parts)
-        window_width = width // 2
-        window_height = height // 2
-        latest_deforestation_file=output_file.replace("layer","timesinceloss")
-        create_latest_deforestation= not os.path.isfile(latest_deforestation_file)
-        threemonths_file=output_file.replace("layer","lastthreemonths")
-        create_threemonths = not os.path.isfile(threemonths_file)
-        sixmonths_file=output_file.replace("layer","lastsixmonths")
-        create_sixmonths = not os.path.isfile(sixmonths_file) 
-        twelvetosixmonths_file=output_file.replace("layer","previoussameseason")
-        create_twelvetosixmonths = not os.path.isfile(twelvetosixmonths_file)
-        totaldeforestation_file=output_file.replace("layer","totallossalerts")
-        create_totaldeforestation = not os.path.isfile(totaldeforestation_file)
-        groundtruth1m_file=output_file.replace("layer","groundtruth1m").replace("input","groundtruth")
-        groundtruth1m_file=modify_date_in_path(groundtruth1m_file,1)
-        create_groundtruth1m = not os.path.isfile(groundtruth1m_file) and groundtruth1m_called==1
-        groundtruth3m_file=output_file.replace("layer","groundtruth3m").replace("input","groundtruth")
-        groundtruth3m_file=modify_date_in_path(groundtruth3m_file,3)
-        create_groundtruth3m = not os.path.isfile(groundtruth3m_file) and groundtruth3m_called==1
-        groundtruth6m_file=output_file.replace("layer","groundtruth6m").replace("input","groundtruth")
-        groundtruth6m_file=modify_date_in_path(groundtruth6m_file,6)
-        create_groundtruth6m = not os.path.isfile(groundtruth6m_file) and groundtruth6m_called==1
-        groundtruth12m_file=output_file.replace("layer","groundtruth12m").replace("input","groundtruth")
-        groundtruth12m_file=modify_date_in_path(groundtruth12m_file,12)
-        create_groundtruth12m = not os.path.isfile(groundtruth12m_file) and groundtruth12m_called==1
-        confidence_file=output_file.replace("layer","confidence")
-        create_confidence = not os.path.isfile(confidence_file)
-        patchiness_file=output_file.replace("layer","patchdensity")
-        create_patchiness = not os.path.isfile(patchiness_file)
-        smoothedtotal_file=output_file.replace("layer","smoothedtotal")
-        create_smoothedtotal = not os.path.isfile(smoothedtotal_file)
-        smoothedsixmonths_file=output_file.replace("layer","smoothedsixmonths")
-        create_smoothedsixmonths = not os.path.isfile(smoothedsixmonths_file)
-        lastmonth_file=output_file.replace("layer","lastmonth")
-        create_lastmonth = not os.path.isfile(lastmonth_file)
-        # Iterate over windows
-        if any([create_confidence,create_groundtruth1m,create_groundtruth3m,create_groundtruth6m,create_groundtruth12m,create_totaldeforestation,create_sixmonths,create_threemonths,
-            create_twelvetosixmonths,create_latest_deforestation,create_patchiness,create_smoothedtotal,create_smoothedsixmonths,create_lastmonth,create_groundtruth12m,create_groundtruth1m,create_groundtruth3m,create_groundtruth6m]):
-            
-            for i in range(num_windows):
-                # Calculate the starting coordinates of the window
-                col_offset = (i % 2) * window_width
-                row_offset = (i // 2) * window_height
-                offy1=col_offset//40
-                offx1=row_offset//40
-
-                # Define the window
-                window = Window(col_offset, row_offset, window_width, window_height)
-                # Read the data within the window
-                data = src.read(window=window)
-                if i==0:
-                    template=np.zeros((data.shape[1]//20,data.shape[2]//20))
-                    if create_latest_deforestation: latest_deforestation=template.copy()
-                    if create_threemonths: threemonths=template.copy()
-                    if create_sixmonths or create_smoothedsixmonths: sixmonths=template.copy()
-                    if create_twelvetosixmonths: twelvetosixmonths=template.copy()
-                    if create_totaldeforestation or create_smoothedtotal: totaldeforestation=template.copy()
-                    if create_confidence: confidence=template.copy()
-                    if create_patchiness: patchiness=template.copy()
-                    if create_lastmonth: lastmonth=template.copy()
-
-                offx2=(offx1+(template.shape[0]//2))
-                offy2=(offy1+(template.shape[1]//2))
-
-
-                # Take the remainder of 10000 for every pixel
-                if create_confidence: confidence[offx1:offx2,offy1:offy2]=aggregate_by_40_max((np.remainder(np.nan_to_num(data), 10000)<relative_date).astype(int)*data//10000,fun="nanmean")
-                data = np.remainder(np.nan_to_num(data), 10000)
-                #remove all future data for the next features
-                data[data>relative_date]=0
-
-                
-                
-
-
-                #remove current date from data to get relative date, ignoring 0's, then aggregate by 40.     
-                if create_latest_deforestation: latest_deforestation[offx1:offx2,offy1:offy2]=aggregate_by_40_max(np.multiply(np.divide(data,relative_date),10000).astype(int),fun="max")
-
-                #remove current date from data to get relative date, ignoring 0's, then aggregate by 40.  
-                if create_lastmonth: lastmonth[offx1:offx2,offy1:offy2]=aggregate_by_40_max((data>(relative_date-30)).astype(int),fun="sum")
-                if create_threemonths: threemonths[offx1:offx2,offy1:offy2]=aggregate_by_40_max((data>(relative_date-92)).astype(int),fun="sum")
-                if create_sixmonths or create_smoothedsixmonths: sixmonths[offx1:offx2,offy1:offy2]=aggregate_by_40_max((data>(relative_date-183)).astype(int),fun="sum")
-                #for now patchiness uses 6 months as well.
-                if create_patchiness: patchiness[offx1:offx2,offy1:offy2]=fun_patchiness((data>(relative_date-183)).astype(int))
-                if create_twelvetosixmonths: twelvetosixmonths[offx1:offx2,offy1:offy2]=aggregate_by_40_max(((data<=(relative_date-183))&(data>(relative_date-366))).astype(int),fun="sum")
-                if create_totaldeforestation or create_smoothedtotal: totaldeforestation[offx1:offx2,offy1:offy2]=aggregate_by_40_max((data>0).astype(int),fun="sum")
-
-                   
-            if create_latest_deforestation:
-                with rasterio.open(latest_deforestation_file, 'w', driver='GTiff',compress='LZW', width=width//40, height=height//40, count=1, dtype=src.dtypes[0], crs=src.crs, transform=newtransform) as dst:
-                    dst.write(latest_deforestation.reshape(1,latest_deforestation.shape[0],latest_deforestation.shape[1]))
-
-
-            if create_threemonths:
-                with rasterio.open(threemonths_file, 'w', driver='GTiff',compress='LZW', width=width//40, height=height//40, count=1, dtype=src.dtypes[0], crs=src.crs, transform=newtransform) as dst:
-                    dst.write(threemonths.reshape(1,threemonths.shape[0],threemonths.shape[1]))
-
-            
-            if create_sixmonths:
-                with rasterio.open(sixmonths_file, 'w', driver='GTiff',compress='LZW', width=width//40, height=height//40, count=1, dtype=src.dtypes[0], crs=src.crs, transform=newtransform) as dst:
-                    dst.write(sixmonths.reshape(1,sixmonths.shape[0],sixmonths.shape[1]))
-
-            
-            if create_twelvetosixmonths:
-                with rasterio.open(twelvetosixmonths_file, 'w', driver='GTiff',compress='LZW', width=width//40, height=height//40, count=1, dtype=src.dtypes[0], crs=src.crs, transform=newtransform) as dst:
-                    dst.write(twelvetosixmonths.reshape(1,twelvetosixmonths.shape[0],twelvetosixmonths.shape[1]))
-
-            
-            if create_totaldeforestation:
-                with rasterio.open(totaldeforestation_file, 'w', driver='GTiff',compress='LZW', width=width//40, height=height//40, count=1, dtype=src.dtypes[0], crs=src.crs, transform=newtransform) as dst:
-                    dst.write(totaldeforestation.reshape(1,totaldeforestation.shape[0],totaldeforestation.shape[1]))
-            
-            if create_confidence:
-                with rasterio.open(confidence_file, 'w', driver='GTiff',compress='LZW', width=width//40, height=height//40, count=1, dtype="float32", crs=src.crs, transform=newtransform) as dst:
-                    dst.write(confidence.reshape(1,confidence.shape[0],confidence.shape[1]))
-
-            if create_patchiness:
-                with rasterio.open(patchiness_file, 'w', driver='GTiff',compress='LZW', width=width//40, height=height//40, count=1, dtype="uint16", crs=src.crs, transform=newtransform) as dst:
-                    dst.write(patchiness.reshape(1,patchiness.shape[0],patchiness.shape[1]))
-
-            if create_smoothedtotal:
-                smoothedtotal=weighted_smoothing(totaldeforestation, window_size=31)
-                with rasterio.open(smoothedtotal_file, 'w', driver='GTiff',compress='LZW', width=width//40, height=height//40, count=1, dtype="uint16", crs=src.crs, transform=newtransform) as dst:
-                    dst.write(smoothedtotal.reshape(1,smoothedtotal.shape[0],smoothedtotal.shape[1]))
-
-            if create_smoothedsixmonths:
-                smoothedsixmonths=weighted_smoothing(sixmonths, window_size=31)
-                with rasterio.open(smoothedsixmonths_file, 'w', driver='GTiff',compress='LZW', width=width//40, height=height//40, count=1, dtype="uint16", crs=src.crs, transform=newtransform) as dst:
-                    dst.write(smoothedsixmonths.reshape(1,smoothedsixmonths.shape[0],smoothedsixmonths.shape[1]))
-            
-            if create_lastmonth:
-                with rasterio.open(lastmonth_file, 'w', driver='GTiff',compress='LZW', width=width//40, height=height//40, count=1, dtype="uint16", crs=src.crs, transform=newtransform) as dst:
-                    dst.write(lastmonth.reshape(1,lastmonth.shape[0],lastmonth.shape[1]))
-
-            if create_groundtruth1m:
-                with rasterio.open(groundtruth1m_file, 'w', driver='GTiff',compress='LZW', width=width//40, height=height//40, count=1, dtype="uint16", crs=src.crs, transform=newtransform) as dst:
-                    dst.write(lastmonth.reshape(1,lastmonth.shape[0],lastmonth.shape[1]))
-                    
-            if create_groundtruth3m:
-                with rasterio.open(groundtruth3m_file, 'w', driver='GTiff',compress='LZW', width=width//40, height=height//40, count=1, dtype="uint16", crs=src.crs, transform=newtransform) as dst:
-                    dst.write(threemonths.reshape(1,threemonths.shape[0],threemonths.shape[1]))
-
-            if create_groundtruth6m:
-                with rasterio.open(groundtruth6m_file, 'w', driver='GTiff',compress='LZW', width=width//40, height=height//40, count=1, dtype="uint16", crs=src.crs, transform=newtransform) as dst:
-                    dst.write(sixmonths.reshape(1,sixmonths.shape[0],sixmonths.shape[1]))
-
-            if create_groundtruth12m:
-                with rasterio.open(groundtruth12m_file, 'w', driver='GTiff',compress='LZW', width=width//40, height=height//40, count=1, dtype="uint16", crs=src.crs, transform=newtransform) as dst:
-                    dst.write((sixmonths+twelvetosixmonths).reshape(1,twelvetosixmonths.shape[0],twelvetosixmonths.shape[1]))
-
+        # every path is built from the tile and date of the output file, <prep_folder>/input/<tile>/<tile>_<date>_layer.tif
+        prep_folder,output_key,_=parse_layer_path(output_file)
+        timer=stage_timer(profile_log,script="IA-processing_monthly",tile=output_key.tile,
+                          dates=[TileDate.from_relative_date(output_key.tile,date).date_string for date in relative_dates] if len(relative_dates)>1 else [output_key.date_string])
+        plans={}
+        for date in relative_dates:
+            key=TileDate.from_relative_date(output_key.tile,date) if len(relative_dates)>1 else output_key
+            if planned_layers is not None: layer_files=planned_to_create(prep_folder,key,planned_layers.get(date,[]),output_format,groundtruth_called)
+            elif output_format=="multiband": layer_files=multiband_to_create(prep_folder,key,groundtruth_called)
+            elif output_format=="cube": layer_files=cube_layers_to_create(prep_folder,key,groundtruth_called)
+            else: layer_files=layers_to_create(prep_folder,key,groundtruth_called)
+            if layer_files: plans[date]=layer_files
+        if not plans:
+            # a tile without work still gets its record in the run log, without stages
+            timer.write()
+            return
+
+        features={date:sorted({feature for layer in layer_files for feature in LAYERS[layer][0]}) for date,layer_files in plans.items()}
+        blocks={date:{feature:np.zeros((height//40,width//40),dtype=FEATURE_DTYPES[feature]) for feature in date_features} for date,date_features in features.items()}
+        if use_cache:
+            with timer.stage("cache"):
+                cache=load_block_date_cache(input_file,memory_budget)
+            for date in plans:
+                for feature,values in index_features(cache,date,[feature for feature in features[date] if feature!="patchdensity"],timer=timer).items():
+                    blocks[date][feature][:]=values
+            features={date:["patchdensity"] for date in plans if "patchdensity" in features[date]}
+
+        # stream block aligned row strips through one reusable read buffer so memory is bounded by the budget.
+        # strips and columns without alerts are not read at all, their blocks stay zero
+        with timer.stage("occupancy"):
+            occupancy=block_occupancy(input_file,src) if features else None
+        windows=strip_windows(width,height,memory_budget=memory_budget/strip_workers,num_windows=num_windows,occupancy=occupancy) if features else []
+        if strip_workers>1 and features:
+            # every worker opens the tile itself and returns only the block features of its strips
+            with ProcessPoolExecutor(max_workers=strip_workers) as executor:
+                strip_blocks=executor.map(read_strip_features,repeat(input_file),windows,repeat(features),repeat(BLOCK_SIZE),repeat(timer.timed),repeat(memory_budget/strip_workers))
+        else:
+            strip_blocks=strip_features(src,windows,features,timer)
+        for window,window_blocks,strip_stages,strip_peak in strip_blocks:
+            # the stages of a worker add up the seconds of all workers, not the wall time
+            timer.add(strip_stages)
+            timer.add_peak(strip_peak)
+            offx1=window.row_off//40
+            offx2=offx1+window.height//40
+            offy1=window.col_off//40
+            offy2=offy1+window.width//40
+            for date,date_blocks in window_blocks.items():
+                for feature,values in date_blocks.items():
+                    blocks[date][feature][offx1:offx2,offy1:offy2]=values
+
+        halo_blocks={}
+        if halo:
+            smoothed={date:sorted({SMOOTHED_LAYERS[layer] for layer in layer_files if layer in SMOOTHED_LAYERS}) for date,layer_files in plans.items()}
+            smoothed={date:date_features for date,date_features in smoothed.items() if date_features}
+            if smoothed:
+                with timer.stage("halo"):
+                    halo_blocks=halo_block_features(input_file,blocks,smoothed,SMOOTHING_WINDOW//2)
+
+        with ThreadPoolExecutor(max_workers=write_threads) as writer:
+            writes=[]
+            if output_format=="cube":
+                # every layer is its own array in the cube, so the layers are written concurrently with all their dates at once
+                series={}
+                for date,layer_dates in plans.items():
+                    for layer,layer_date in layer_dates.items():
+                        with timer.stage(layer_stage(layer)):
+                            series.setdefault(layer,{})[layer_date]=layer_array(layer,blocks[date],halo_blocks.get(date)).astype(LAYERS[layer][1])
+                if series: create_cube(cube_file(prep_folder,output_key))
+                for layer,layers in series.items():
+                    writes.append(writer.submit(timed,timer,"write",write_feature,cube_file(prep_folder,output_key),layer,layers,src.crs,newtransform))
+            else:
+                for date,layer_files in plans.items():
+                    file_layers={}
+                    for layer,layer_file in layer_files.items():
+                        file_layers.setdefault(layer_file,[]).append(layer)
+                    for layer_file,layers in file_layers.items():
+                        arrays=[]
+                        for layer in layers:
+                            with timer.stage(layer_stage(layer)):
+                                arrays.append(layer_array(layer,blocks[date],halo_blocks.get(date)))
+                        writes.append(writer.submit(timed,timer,"write",write_layers,layer_file,layers,arrays,src.crs,newtransform))
+            # raises the first error of the writers
+            for write in writes: write.result()
+    timer.write()
 
 if __name__ == "__main__":
     # Create a command-line argument parser
     parser = argparse.ArgumentParser(description="Apply calculation to a geotiff image.")
     parser.add_argument("input_image", help="Path to the input geotiff image")
     parser.add_argument("output_image", help="Path to the output geotiff image")
-    parser.add_argument("relative_date", help="relative date")
+    parser.add_argument("relative_date", help="relative date, or a comma separated list of relative dates that are all processed from one read")
     parser.add_argument("--groundtruth1m", help="should groundtruth1m be processed",default=1,required=False)
     parser.add_argument("--groundtruth3m", help="should groundtruth3m be processed",default=1,required=False)
     parser.add_argument("--groundtruth6m", help="should groundtruth6m be processed",default=1,required=False)
     parser.add_argument("--groundtruth12m", help="should groundtruth12m be processed",default=1,required=False)
-    parser.add_argument("--num_windows", help="number of windows, depends on RAM size.",default=4,required=False)
+    parser.add_argument("--num_windows", help="number of row strips, overrides the memory budget when given.",default=None,required=False)
+    parser.add_argument("--memory_budget", help="memory budget in MB for the row strips and the GDAL block cache (10%%), on top of the about 100 MB of python and its libraries.",default=DEFAULT_MEMORY_BUDGET,required=False)
+    parser.add_argument("--use_cache", help="look the features up in the block date cache of the tile, building it if needed",default=0,required=False)
+    parser.add_argument("--halo", help="smooth across the tile border with the neighbouring alert tiles in the same folder",default=0,required=False)
+    parser.add_argument("--output_format", help="layers writes every layer to its own file, multiband all layers of a date to one <tile>_<date>_features.tif, cube into the feature cube of the tile",choices=OUTPUT_FORMATS,default="layers",required=False)
+    parser.add_argument("--write_threads", help="number of threads that compress and write the layers",default=WRITE_THREADS,required=False)
+    parser.add_argument("--strip_workers", help="number of worker processes that read and aggregate the strips of the tile",default=1,required=False)
+    parser.add_argument("--profile_log", help="append the seconds per stage and the peak memory to this .jsonl or .csv run log",default=None,required=False)
     args = parser.parse_args()
     # Replace 'your_geotiff_file.tif' with the actual file path
     input_geotiff =  args.input_image
     output_geotiff = args.output_image
-    reldate=int(args.relative_date)
-    num_windows=int(args.num_windows)
-    process_geotiff(input_geotiff,output_geotiff,reldate,num_windows = num_windows,
+    reldate=[int(date) for date in args.relative_date.split(",")]
+    if len(reldate)==1: reldate=reldate[0]
+    num_windows=int(args.num_windows) if args.num_windows is not None else None
+    process_geotiff(input_geotiff,output_geotiff,reldate,num_windows = num_windows,memory_budget=float(args.memory_budget),use_cache=int(args.use_cache)==1,halo=int(args.halo)==1,output_format=args.output_format,write_threads=int(args.write_threads),strip_workers=int(args.strip_workers),profile_log=args.profile_log,
         groundtruth1m_called=int(args.groundtruth1m),groundtruth3m_called=int(args.groundtruth3m),groundtruth6m_called=int(args.groundtruth6m),groundtruth12m_called=int(args.groundtruth12m))
\ No newline at end of file
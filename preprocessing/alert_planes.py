@@ -0,0 +1,77 @@
+import argparse
+import os
+import numpy as np
+import rasterio
+from numpy.lib.format import open_memmap
+from ia_cache import source_stamp
+from ia_features import DATE_DIVISOR, DEFAULT_MEMORY_BUDGET, gdal_cache_env, strip_windows
+
+# the integrated alerts split once into a uint16 plane with the days since 2015-01-01 and a uint8 plane with the
+# confidence, instead of computing value % 10000 and value // 10000 on every read. the planes of a tile can be kept
+# next to it as memory mapped .npy files, which any script reads as plain arrays without decoding or GDAL
+
+
+def split_alerts(data, date=None, confidence=None):
+    # decodes a window of encoded alerts into the date and confidence buffers when they are given, so a
+    # loop over windows can reuse them instead of allocating new arrays for every window
+    if date is None:
+        date = np.empty(data.shape, dtype=np.uint16)
+    if confidence is None:
+        confidence = np.empty(data.shape, dtype=np.uint8)
+    np.remainder(data, DATE_DIVISOR, out=date, casting="unsafe")
+    np.floor_divide(data, DATE_DIVISOR, out=confidence, casting="unsafe")
+    return date, confidence
+
+
+def planes_paths(input_file):
+    # the date and confidence planes and the stamp of the tile they were made from, which is written last
+    base = os.path.splitext(input_file)[0]
+    return base + "_date.npy", base + "_confidence.npy", base + "_planes.npz"
+
+
+def build_alert_planes(input_file, memory_budget=DEFAULT_MEMORY_BUDGET):
+    date_path, confidence_path, stamp_path = planes_paths(input_file)
+    if os.path.isfile(stamp_path):
+        os.remove(stamp_path)
+    with gdal_cache_env(memory_budget), rasterio.open(input_file) as src:
+        date = open_memmap(date_path, mode="w+", dtype=np.uint16, shape=(src.height, src.width))
+        confidence = open_memmap(confidence_path, mode="w+", dtype=np.uint8, shape=(src.height, src.width))
+        buffer = None
+        # row strips of single pixel rows, so the planes also cover a partial block at the edge
+        for window in strip_windows(src.width, src.height, memory_budget=memory_budget, block_size=1):
+            if buffer is None or buffer.size < window.height * window.width: buffer = np.empty(window.height * window.width, dtype=src.dtypes[0])
+            data = src.read(1, window=window, out=buffer[:window.height * window.width].reshape(window.height, window.width))
+            rows = slice(window.row_off, window.row_off + window.height)
+            split_alerts(data, date[rows], confidence[rows])
+        date.flush()
+        confidence.flush()
+        del date, confidence
+    np.savez(stamp_path, stamp=source_stamp(input_file))
+    return load_alert_planes(input_file, rebuild=False)
+
+
+def load_alert_planes(input_file, memory_budget=DEFAULT_MEMORY_BUDGET, rebuild=True):
+    # returns the read only memory mapped date and confidence planes of the tile, building them first when they
+    # are missing or older than the tile
+    date_path, confidence_path, stamp_path = planes_paths(input_file)
+    if os.path.isfile(stamp_path):
+        with np.load(stamp_path) as stamp:
+            if np.array_equal(stamp["stamp"], source_stamp(input_file)):
+                return np.load(date_path, mmap_mode="r"), np.load(confidence_path, mmap_mode="r")
+    if not rebuild:
+        raise FileNotFoundError(f"no up to date alert planes for {input_file}")
+    return build_alert_planes(input_file, memory_budget)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Decode integrated alert tiles into memory mapped date and confidence planes.")
+    parser.add_argument("input_images", nargs="+", help="Paths to the integrated alert geotiffs")
+    parser.add_argument("--memory_budget", help="memory budget in MB for the row strips and the GDAL block cache (10%%), on top of the about 100 MB of python and its libraries.", default=DEFAULT_MEMORY_BUDGET, required=False)
+    parser.add_argument("--force", help="rebuild the planes even if they are up to date", default=0, required=False)
+    args = parser.parse_args()
+    for input_image in args.input_images:
+        if int(args.force) == 1:
+            build_alert_planes(input_image, float(args.memory_budget))
+        else:
+            load_alert_planes(input_image, float(args.memory_budget))
+        print(f"alert planes ready for {input_image}")
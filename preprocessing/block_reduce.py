@@ -0,0 +1,165 @@
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+# reduces the last two axes of an array by blocks of factor x factor pixels, for any factor and rectangular arrays.
+# the block rows are reduced first: that is an elementwise reduction over whole contiguous image rows, after which
+# only one row per block row is left to reduce along the columns. boolean and integer input is summed in the smallest
+# accumulator that cannot overflow, so a 40x40 count of a mask is summed in uint8 and uint16 instead of int64
+# upsampled_block_sum gives the block sums of a raster resampled by nearest neighbour to a finer grid without making
+# that grid: along each axis every source pixel is counted as many times as the resampled pixels of a block take it
+
+REDUCTIONS = ["sum", "max", "min", "mean", "nanmean", "count_nonzero", "percentile"]
+
+
+def block_factors(factor):
+    if np.isscalar(factor):
+        factor = (factor, factor)
+    factor_y, factor_x = int(factor[0]), int(factor[1])
+    if factor_y < 1 or factor_x < 1:
+        raise ValueError(f"block factors must be at least 1, not {factor}")
+    return factor_y, factor_x
+
+
+def accumulator(dtype, count):
+    # the smallest integer type that holds the sum of count values of dtype, or None when the values are not integers
+    dtype = np.dtype(dtype)
+    if dtype == bool:
+        largest = count
+    elif dtype.kind in "ui":
+        largest = int(max(abs(np.iinfo(dtype).min), np.iinfo(dtype).max)) * count
+    else:
+        return None
+    signed = dtype.kind == "i"
+    for candidate in (np.int8, np.int16, np.int32, np.int64) if signed else (np.uint8, np.uint16, np.uint32, np.uint64):
+        if np.iinfo(candidate).max >= largest:
+            return np.dtype(candidate)
+    return np.dtype(np.int64 if signed else np.uint64)
+
+
+def block_sum(blocks):
+    # blocks has the shape (..., rows, factor_y, cols, factor_x)
+    factor_y, factor_x = blocks.shape[-3], blocks.shape[-1]
+    values = blocks.dtype
+    if values == bool:
+        # a mask is summed as bytes of zeros and ones
+        blocks = blocks.view(np.uint8)
+    if accumulator(values, 1) is None:
+        return blocks.sum(axis=-3).sum(axis=-1)
+    rows = blocks.sum(axis=-3, dtype=accumulator(values, factor_y))
+    return rows.sum(axis=-1, dtype=accumulator(values, factor_y * factor_x))
+
+
+def reduce_blocks(blocks, fun, q=None):
+    factor_y, factor_x = blocks.shape[-3], blocks.shape[-1]
+    if fun == "sum":
+        return block_sum(blocks)
+    if fun == "max":
+        return blocks.max(axis=-3).max(axis=-1)
+    if fun == "min":
+        return blocks.min(axis=-3).min(axis=-1)
+    if fun == "mean":
+        return block_sum(blocks) / (factor_y * factor_x)
+    if fun == "count_nonzero":
+        return block_sum(blocks != 0)
+    if fun == "nanmean":
+        # the mean of the pixels that are not nan, nan for a block without any. only floats can hold nan
+        if blocks.dtype.kind != "f":
+            return block_sum(blocks) / (factor_y * factor_x)
+        valid = ~np.isnan(blocks)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return block_sum(np.where(valid, blocks, 0)) / block_sum(valid)
+    if fun == "percentile":
+        if q is None:
+            raise ValueError("the percentile reduction needs q")
+        pixels = np.moveaxis(blocks.view(np.uint8) if blocks.dtype == bool else blocks, -3, -2)
+        pixels = pixels.reshape(pixels.shape[:-2] + (factor_y * factor_x,))
+        return np.percentile(pixels, q, axis=-1)
+    raise ValueError(f"unknown reduction {fun}, choose from {', '.join(REDUCTIONS)}")
+
+
+def reduce_full_blocks(array, factor_y, factor_x, fun, q=None):
+    rows = array.shape[-2] // factor_y
+    cols = array.shape[-1] // factor_x
+    blocks = array[..., :rows * factor_y, :cols * factor_x].reshape(array.shape[:-2] + (rows, factor_y, cols, factor_x))
+    return reduce_blocks(blocks, fun, q)
+
+
+def reduce_partial(array, factor_y, factor_x, fun, q=None):
+    # like reduce_full_blocks, with the last block row and column reduced over the pixels that are there
+    height, width = array.shape[-2:]
+    row_parts = [(0, height - height % factor_y, factor_y)] + ([(height - height % factor_y, height, height % factor_y)] if height % factor_y else [])
+    col_parts = [(0, width - width % factor_x, factor_x)] + ([(width - width % factor_x, width, width % factor_x)] if width % factor_x else [])
+    return np.concatenate([
+        np.concatenate([reduce_full_blocks(array[..., first_row:last_row, first_col:last_col], row_factor, col_factor, fun, q)
+                        for first_col, last_col, col_factor in col_parts], axis=-1)
+        for first_row, last_row, row_factor in row_parts], axis=-2)
+
+
+def block_reduce(input_array, factor, fun="sum", q=None, partial=False, threads=1):
+    # reduces the last two axes of input_array by blocks of factor (an int or (rows, cols)) pixels with fun, one of
+    # REDUCTIONS (percentile takes q). a trailing partial block row or column is dropped unless partial is True, in
+    # which case it is reduced over the pixels it has. with threads the block rows are split over a thread pool,
+    # numpy releases the GIL in these reductions
+    factor_y, factor_x = block_factors(factor)
+    input_array = np.asarray(input_array)
+    if input_array.ndim < 2:
+        raise ValueError(f"block_reduce needs at least two dimensions, not {input_array.shape}")
+    reduce = reduce_partial if partial else reduce_full_blocks
+    block_rows = -(-input_array.shape[-2] // factor_y) if partial else input_array.shape[-2] // factor_y
+    threads = max(1, min(int(threads), block_rows))
+    if threads == 1:
+        return reduce(input_array, factor_y, factor_x, fun, q)
+    rows_per_strip = -(-block_rows // threads)
+    strips = [input_array[..., first_row * factor_y:(first_row + rows_per_strip) * factor_y, :]
+              for first_row in range(0, block_rows, rows_per_strip)]
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        results = list(executor.map(lambda strip: reduce(strip, factor_y, factor_x, fun, q), strips))
+    return np.concatenate(results, axis=-2)
+
+
+def nearest_weights(source_size, scale, size, factor):
+    # along one axis of a nearest neighbour resampling to size pixels, scale source pixel sizes per resampled pixel,
+    # like rasterio.warp.reproject with the centre of every resampled pixel: the block of factor resampled pixels, the
+    # source pixel and the number of resampled pixels that take it, for every pair of block and source pixel in order.
+    # resampled pixels beyond the source take nothing
+    pixels = np.arange(size)
+    sources = np.floor((pixels + 0.5) / scale).astype(np.int64)
+    inside = sources < source_size
+    pairs, counts = np.unique((pixels[inside] // factor) * source_size + sources[inside], return_counts=True)
+    return pairs // source_size, pairs % source_size, counts
+
+
+def weighted_rows(array, blocks, sources, counts, block_count, chunk_blocks=16):
+    # the sum of the source rows of every block times their counts, a few blocks at a time so only their rows are copied
+    total = np.zeros((block_count,) + array.shape[1:], dtype=np.float64 if array.dtype.kind == "f" else np.int64)
+    for first_block in range(0, block_count, chunk_blocks):
+        first, last = np.searchsorted(blocks, [first_block, first_block + chunk_blocks])
+        if first == last:
+            continue
+        starts = np.flatnonzero(np.r_[True, blocks[first + 1:last] != blocks[first:last - 1]])
+        rows = array[sources[first:last]] * counts[first:last].reshape((-1,) + (1,) * (array.ndim - 1))
+        total[blocks[first:last][starts]] = np.add.reduceat(rows, starts, axis=0)
+    return total
+
+
+def upsampled_block_sum(input_array, scale, factor, shape=None):
+    # the sums of blocks of factor (an int or (rows, cols)) pixels of input_array resampled by nearest neighbour to
+    # scale (an int or (rows, cols)) times its resolution and shape (default: its shape times scale), blocks at the
+    # edge summed over what they have. when the scale is whole and divides the factor every source pixel is taken
+    # scale x scale times, which is a block sum of the input itself. the sums are int64, or float64 for floats
+    factor_y, factor_x = block_factors(factor)
+    scale_y, scale_x = (scale, scale) if np.isscalar(scale) else scale
+    input_array = np.asarray(input_array)
+    if input_array.dtype == bool:
+        input_array = input_array.view(np.uint8)
+    height, width = input_array.shape
+    if shape is None:
+        shape = (int(round(height * scale_y)), int(round(width * scale_x)))
+    whole_y, whole_x = int(round(scale_y)), int(round(scale_x))
+    if (np.isclose(scale_y, whole_y) and np.isclose(scale_x, whole_x) and whole_y >= 1 and whole_x >= 1
+            and factor_y % whole_y == 0 and factor_x % whole_x == 0 and tuple(shape) == (height * whole_y, width * whole_x)):
+        sums = block_reduce(input_array, (factor_y // whole_y, factor_x // whole_x), "sum", partial=True)
+        return sums.astype(np.float64 if sums.dtype.kind == "f" else np.int64) * (whole_y * whole_x)
+    block_rows, block_cols = -(-shape[0] // factor_y), -(-shape[1] // factor_x)
+    rows = weighted_rows(input_array, *nearest_weights(height, scale_y, shape[0], factor_y), block_rows)
+    return weighted_rows(rows.T, *nearest_weights(width, scale_x, shape[1], factor_x), block_cols).T
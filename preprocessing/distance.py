@@ -1,42 +1,39 @@
 import argparse
+import os
 import rasterio
-import numpy as np
-from scipy.ndimage import distance_transform_edt
+from tile_halo import TILE_ID
+from feature_cube import cube_path, write_feature
+from distance_engine import DEFAULT_STRIP_ROWS, closeness_raster, nonzero_features
 
-def distance_to_nearest_nonzero_geotiff(input_geotiff, output_geotiff):
-    # Read the GeoTIFF file
-    with rasterio.open(input_geotiff) as src:
-        # Read the data
-        input_array = src.read(1)
-        # Get the metadata for creating the output GeoTIFF
-        metadata = src.profile
-
-    # Create a binary mask where zeros are treated as foreground and non-zeros as background
-    input_array[np.isnan(input_array)]=0
-    mask = input_array == 0
-    print(np.max(mask))
-    print(np.max(input_array))
-
-    # Calculate Euclidean distance transform
-    distance_transform = distance_transform_edt(mask)
-    distance_transform=np.round(255-20*np.log(distance_transform+1))
-    # Update metadata for the output GeoTIFF
-    metadata.update(dtype='float32', count=1)
-    distance_transform[distance_transform>255]=255
-    distance_transform[distance_transform <0] = 0
-    distance_transform[np.isnan(distance_transform)] = 0
-    # Write the distance transform array to a new GeoTIFF file
-    with rasterio.open(output_geotiff, 'w', **metadata) as dst:
-        dst.write(distance_transform, 1)
+def distance_to_nearest_nonzero_geotiff(input_geotiff, output_geotiff, halo=0, cube_folder=None, date=None, feature=None, max_distance=None, strip_rows=DEFAULT_STRIP_ROWS):
+    # writes the closeness 255-20*ln(distance+1) to the nearest nonzero pixel as uint8, strip by strip (see distance_engine.py).
+    # with a halo (in pixels) the features of the neighbouring tiles in the same folder within that distance of the
+    # border are included (see tile_halo.py), so roads just across a tile border are no longer missed.
+    # with max_distance (in pixels) every pixel further away gets the closeness of max_distance.
+    # with a cube folder the result is also stored as feature at date in the feature cube of the tile in the input name
+    closeness_raster(input_geotiff, output_geotiff, nonzero_features, halo, max_distance, strip_rows)
+    if cube_folder is not None:
+        with rasterio.open(output_geotiff) as src:
+            tile = TILE_ID.search(os.path.basename(input_geotiff)).group(0)
+            write_feature(cube_path(cube_folder, tile), feature, {date: src.read(1)}, src.crs, src.transform)
 
 def main():
     parser = argparse.ArgumentParser(description='Calculate Euclidean distance to nearest non-zero value in a GeoTIFF.')
     parser.add_argument('input_geotiff', help='Path to the input GeoTIFF with 1\'s and 0\'s.')
     parser.add_argument('output_geotiff', help='Path to the output GeoTIFF for storing the distance array.')
+    parser.add_argument('--halo', help='pixels to read from the neighbouring tiles with the same name pattern (e.g. 00N_010E) around the tile.', default=0, required=False)
+    parser.add_argument('--cube_folder', help='also store the result in the feature cube of the tile in this folder.', default=None, required=False)
+    parser.add_argument('--date', help='date (yyyy-mm-dd) of the result in the feature cube.', default=None, required=False)
+    parser.add_argument('--feature', help='feature name of the result in the feature cube, e.g. closenesstoroads.', default=None, required=False)
+    parser.add_argument('--max_distance', help='pixels beyond which the closeness is that of max_distance.', default=None, required=False)
+    parser.add_argument('--strip_rows', help='rows of the input raster that are processed at once.', default=DEFAULT_STRIP_ROWS, required=False)
 
     args = parser.parse_args()
 
-    distance_to_nearest_nonzero_geotiff(args.input_geotiff, args.output_geotiff)
+    if args.cube_folder is not None and (args.date is None or args.feature is None):
+        parser.error('--cube_folder needs --date and --feature')
+    distance_to_nearest_nonzero_geotiff(args.input_geotiff, args.output_geotiff, int(args.halo), args.cube_folder, args.date, args.feature,
+                                        float(args.max_distance) if args.max_distance is not None else None, int(args.strip_rows))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
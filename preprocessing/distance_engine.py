@@ -0,0 +1,222 @@
+import math
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+from scipy.ndimage import distance_transform_edt
+from tile_halo import read_mosaic_window
+
+# shared distance transform of the closeness features (roads, waterways, cropland, cattle, ...): the euclidean
+# distance in pixels to the nearest feature pixel, scaled to a uint8 closeness of round(255 - 20*ln(distance + 1)).
+# the raster is streamed in row strips with an exact separable distance transform. a bottom-up pass keeps, for every
+# column, the row of the nearest feature below each strip (one row of state per strip), and the top-down pass keeps the
+# row of the nearest feature above, so every pixel of a strip knows its vertical distance to the nearest feature in
+# each column. the distance along the rows is then the lower envelope of those columns: a lower convex hull per row,
+# or, when every vertical distance of the strip is at most the strip height, a distance_transform_edt of the strip with
+# the nearest features around it placed at their true rows. the raster is read twice with one strip in memory, and the
+# result is the same as one distance_transform_edt of the whole raster, also for sparse rasters.
+# the closeness only reaches 0 at SATURATION_DISTANCE, far beyond the size of a tile. with max_distance distances
+# beyond it get the closeness of max_distance
+
+CLOSENESS_SCALE = 20
+# the distance from which round(255 - 20*ln(distance + 1)) is 0, about 340000 pixels
+SATURATION_DISTANCE = math.exp(254.5 / CLOSENESS_SCALE) - 1
+DEFAULT_STRIP_ROWS = 1024
+# the row of the nearest feature of a column without any, above (negative) or below the raster
+NO_FEATURE = 2 ** 30
+METRICS = ["euclidean", "taxicab"]
+# the first guess of the rows around a strip that hold its nearest features
+INITIAL_BAND = 64
+# the band of the next strip relative to the largest distance of the last
+BAND_MARGIN = 1.25
+
+
+def nonzero_features(values, nodata=None):
+    # every pixel that is not zero or NaN is a feature, like rasterized roads
+    return (values != 0) & ~np.isnan(values)
+
+
+def positive_features(values, nodata=None):
+    # the pixels above zero that are not nodata, like the resampled crop grids
+    features = values > 0
+    if nodata is not None:
+        features &= values != nodata
+    return features
+
+
+def threshold_features(threshold):
+    # the pixels of at least threshold, like the cattle density
+    def features(values, nodata=None):
+        return values >= threshold
+    return features
+
+
+def closeness(distance):
+    # the uint8 closeness of distances in pixels
+    scaled = np.round(255 - CLOSENESS_SCALE * np.log(distance + 1))
+    return np.clip(scaled, 0, 255).astype(np.uint8)
+
+
+def first_feature_rows(features, first_row, last=False):
+    # the row of the first (or last) feature of every column of a strip that starts at first_row, or NO_FEATURE
+    ordered = features[::-1] if last else features
+    index = ordered.argmax(axis=0)
+    found = ordered[index, np.arange(features.shape[1])]
+    rows = first_row + (features.shape[0] - 1 - index if last else index)
+    return np.where(found, rows, -NO_FEATURE if last else NO_FEATURE).astype(np.int32)
+
+
+def column_distances(features, first_row, above, below):
+    # the vertical distance of every pixel of a strip to the nearest feature in its column, given the rows of the
+    # nearest features above and below the strip
+    rows = np.arange(first_row, first_row + features.shape[0], dtype=np.int32)[:, None]
+    nearest_above = np.maximum.accumulate(np.where(features, rows, np.int32(-NO_FEATURE)), axis=0)
+    np.maximum(nearest_above, above, out=nearest_above)
+    nearest_below = np.minimum.accumulate(np.where(features, rows, np.int32(NO_FEATURE))[::-1], axis=0)[::-1]
+    np.minimum(nearest_below, below, out=nearest_below)
+    return np.minimum(rows - nearest_above, nearest_below - rows)
+
+
+def taxicab_rows(vertical):
+    # min over the columns c of |col - c| + vertical[row, c]: a running minimum from the left and from the right
+    cols = np.arange(vertical.shape[1], dtype=np.int64)
+    vertical = vertical.astype(np.int64)
+    from_left = np.minimum.accumulate(vertical - cols, axis=1) + cols
+    from_right = np.minimum.accumulate((vertical + cols)[:, ::-1], axis=1)[:, ::-1] - cols
+    return np.minimum(from_left, from_right)
+
+
+def envelope_rows(vertical):
+    # min over the columns c of (col - c)^2 + vertical[row, c]^2, which is col^2 plus the minimum of
+    # c^2 + vertical^2 - 2*col*c over the points (c, c^2 + vertical^2) of the row: their lower convex hull. all rows
+    # are pruned together, every round drops the points on or above the segment between their neighbours in the row
+    height, width = vertical.shape
+    # a column without any feature is about NO_FEATURE away
+    rows, cols = np.nonzero(vertical < NO_FEATURE // 2)
+    cols = cols.astype(np.int64)
+    heights = cols ** 2 + vertical[rows, cols].astype(np.int64) ** 2
+    while len(rows) >= 3:
+        inner = (rows[1:-1] == rows[:-2]) & (rows[1:-1] == rows[2:])
+        above = inner & ((heights[1:-1] - heights[:-2]) * (cols[2:] - cols[:-2]) >= (heights[2:] - heights[:-2]) * (cols[1:-1] - cols[:-2]))
+        if not above.any():
+            break
+        keep = np.ones(len(rows), dtype=bool)
+        keep[1:-1] = ~above
+        rows, cols, heights = rows[keep], cols[keep], heights[keep]
+    squared = np.empty((height, width), dtype=np.float64)
+    x = np.arange(width, dtype=np.int64)
+    bounds = np.searchsorted(rows, np.arange(height + 1))
+    for row in range(height):
+        hull_cols, hull_heights = cols[bounds[row]:bounds[row + 1]], heights[bounds[row]:bounds[row + 1]]
+        # the vertex of the hull that is lowest for every column: the first whose next edge is steeper than 2*col
+        vertex = np.searchsorted(np.diff(hull_heights) / np.diff(hull_cols), 2 * x, side='left')
+        squared[row] = (x - hull_cols[vertex]) ** 2 + hull_heights[vertex] - hull_cols[vertex] ** 2
+    return np.sqrt(squared)
+
+
+def band_distances(features, first_row, above, below, band):
+    # the distance transform of a strip with the nearest features above and below it within band rows placed at
+    # their rows around it. its distances are at least the true ones, and exact where they are at most band
+    height, width = features.shape
+    image = np.zeros((height + 2 * band, width), dtype=bool)
+    image[band:band + height] = features
+    near = first_row - above <= band
+    image[band - (first_row - above[near]), np.flatnonzero(near)] = True
+    near = below - (first_row + height) < band
+    image[band + height + (below[near] - first_row - height), np.flatnonzero(near)] = True
+    return distance_transform_edt(~image)[band:band + height]
+
+
+def euclidean_rows(features, first_row, above, below, band):
+    # the euclidean distances of a strip and the largest of them, first with a guess of the band that holds the
+    # nearest features. when the largest distance is beyond the band it is done once more with that band, or with the
+    # lower envelope when that band is higher than the strip
+    while band <= features.shape[0]:
+        distances = band_distances(features, first_row, above, below, band)
+        largest = distances.max()
+        if largest <= band:
+            return distances, largest
+        band = int(math.ceil(largest))
+    distances = envelope_rows(column_distances(features, first_row, above, below))
+    return distances, distances.max()
+
+
+def distance_strips(read_features, first_row, last_row, row_limits=None, strip_rows=DEFAULT_STRIP_ROWS, metric="euclidean", max_distance=None):
+    # yields the first row and the distances to the nearest feature of every strip of strip_rows rows of
+    # first_row:last_row, in order. read_features(first, last) returns the feature mask of those rows, which can be
+    # read from row_limits[0] up to row_limits[1] (default: first_row and last_row). the metric is euclidean (like
+    # distance_transform_edt) or taxicab (like distance_transform_cdt(metric='taxicab')). the distances are None when
+    # there is no feature at all within row_limits
+    if metric not in METRICS:
+        raise ValueError(f"unknown metric {metric}, choose from {', '.join(METRICS)}")
+    row_limits = (first_row, last_row) if row_limits is None else row_limits
+    strips = [(first, min(first + strip_rows, last_row)) for first in range(first_row, last_row, strip_rows)]
+
+    # bottom-up: the nearest feature row below every strip, from the rows below last_row and then the strips themselves
+    below = None
+    below_rows = [(first, min(first + strip_rows, row_limits[1])) for first in range(last_row, row_limits[1], strip_rows)]
+    belows = []
+    for first, last in below_rows[::-1]:
+        rows = first_feature_rows(read_features(first, last), first)
+        below = rows if below is None else np.minimum(below, rows)
+    for first, last in strips[::-1]:
+        features = read_features(first, last)
+        belows.append(np.full(features.shape[1], NO_FEATURE, dtype=np.int32) if below is None else below)
+        below = np.minimum(belows[-1], first_feature_rows(features, first))
+    belows = belows[::-1]
+
+    # the nearest feature row above the first strip, from the rows above first_row
+    above = np.full(len(below), -NO_FEATURE, dtype=np.int32)
+    for first in range(row_limits[0], first_row, strip_rows):
+        above = np.maximum(above, first_feature_rows(read_features(first, min(first + strip_rows, first_row)), first, last=True))
+
+    if (below >= NO_FEATURE).all() and (above <= -NO_FEATURE).all():
+        for first, last in strips:
+            yield first, None
+        return
+    band = INITIAL_BAND
+    for (first, last), below in zip(strips, belows):
+        features = read_features(first, last)
+        if metric == "taxicab":
+            distances = taxicab_rows(column_distances(features, first, above, below))
+        else:
+            distances, largest = euclidean_rows(features, first, above, below, band)
+            # the next strip is probably alike, with some margin
+            band = int(math.ceil(largest * BAND_MARGIN))
+        above = np.maximum(above, first_feature_rows(features, first, last=True))
+        if max_distance is not None:
+            distances = np.minimum(distances, max_distance)
+        yield first, distances
+
+
+def closeness_strips(input_file, features=nonzero_features, halo=0, max_distance=None, strip_rows=DEFAULT_STRIP_ROWS):
+    # yields the window and uint8 closeness of every row strip of a single band raster. with a halo (in pixels) the
+    # features of the neighbouring tiles within that distance of the border count as well (see tile_halo.py).
+    # without any feature the closeness is 0 everywhere
+    with rasterio.open(input_file) as src:
+        width, height, nodata = src.width, src.height, src.nodata
+
+        def read_features(first, last):
+            if halo > 0:
+                values = read_mosaic_window(input_file, Window(-halo, first, width + 2 * halo, last - first))
+            else:
+                values = src.read(1, window=Window(0, first, width, last - first))
+            return features(values, nodata)
+
+        for row_off, distances in distance_strips(read_features, 0, height, (-halo, height + halo), strip_rows, max_distance=max_distance):
+            nrows = min(strip_rows, height - row_off)
+            if distances is None:
+                strip = np.zeros((nrows, width), dtype=np.uint8)
+            else:
+                strip = closeness(distances[:, halo:halo + width])
+            yield Window(0, row_off, width, nrows), strip
+
+
+def closeness_raster(input_file, output_file, features=nonzero_features, halo=0, max_distance=None, strip_rows=DEFAULT_STRIP_ROWS):
+    # writes the closeness of a raster as a uint8 GeoTIFF on the grid of the input, strip by strip. the closeness
+    # has a value everywhere, so the output has no nodata
+    with rasterio.open(input_file) as src:
+        profile = src.profile
+    profile.update(dtype=rasterio.uint8, count=1, nodata=None, compress='lzw')
+    with rasterio.open(output_file, 'w', **profile) as dst:
+        for window, strip in closeness_strips(input_file, features, halo, max_distance, strip_rows):
+            dst.write(strip, 1, window=window)
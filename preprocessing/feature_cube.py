@@ -0,0 +1,130 @@
+import argparse
+import os
+import re
+import numpy as np
+import rasterio
+from rasterio.transform import Affine
+try:
+    import zarr
+except ImportError:
+    zarr = None
+
+# a per tile chunked store of the preprocessed features as an alternative to the <tile>_<date>_<feature>.tif tree.
+# every tile is a zarr group <cube_folder>/<tile>.zarr with one array per feature indexed by (date, y, x), so features
+# on different grids can share a tile. the chunks span DATE_CHUNK dates, which puts the monthly series of a block of
+# several years in a single chunk. the dates of a feature are kept in its attributes in the order they were written;
+# only one process should write a feature of a tile at a time
+
+DATE_CHUNK = 64
+SPATIAL_CHUNK = 128
+LAYER_FILE = re.compile(r"^(\d{2}[NS]_\d{3}[EW])_(\d{4}-\d{2}-\d{2})_([A-Za-z0-9]+)\.tif$")
+
+
+def check_zarr():
+    if zarr is None:
+        raise ImportError("the feature cube needs the zarr package (pip install zarr)")
+
+
+def cube_path(cube_folder, tile):
+    return os.path.join(cube_folder, f"{tile}.zarr")
+
+
+def create_cube(path):
+    # the group of the tile, create it before writing features from several threads
+    check_zarr()
+    return zarr.open_group(path, mode="a")
+
+
+def cube_features(path):
+    if not os.path.isdir(path):
+        return []
+    check_zarr()
+    return sorted(zarr.open_group(path, mode="r").array_keys())
+
+
+def feature_dates(path, feature):
+    # the dates the cube holds of a feature, in the order of the date axis
+    if not os.path.isdir(os.path.join(path, feature)):
+        return []
+    check_zarr()
+    return list(zarr.open_array(os.path.join(path, feature), mode="r").attrs["dates"])
+
+
+def write_feature(path, feature, layers, crs, transform):
+    # writes {date: 2D array} of one feature, dates that are already there are overwritten. all dates go in one
+    # assignment so a backfill of many months rewrites every chunk once instead of once per month
+    create_cube(path)
+    array_path = os.path.join(path, feature)
+    first = next(iter(layers.values()))
+    if os.path.isdir(array_path):
+        array = zarr.open_array(array_path, mode="r+")
+        if tuple(array.shape[1:]) != first.shape:
+            raise ValueError(f"{feature} of {path} has shape {tuple(array.shape[1:])}, not {first.shape}")
+    else:
+        array = zarr.open_array(array_path, mode="w-", shape=(0,) + first.shape, dtype=first.dtype, fill_value=0,
+                                chunks=(DATE_CHUNK, SPATIAL_CHUNK, SPATIAL_CHUNK))
+        array.attrs.update({"dates": [], "crs": crs.to_wkt() if crs is not None else None, "transform": list(transform)[:6]})
+    dates = list(array.attrs["dates"])
+    new_dates = [date for date in layers if date not in dates]
+    if new_dates:
+        array.resize((len(dates) + len(new_dates),) + first.shape)
+        dates += new_dates
+    positions = np.array([dates.index(date) for date in layers])
+    stack = np.stack([layer.astype(array.dtype) for layer in layers.values()])
+    array.set_orthogonal_selection((positions, slice(None), slice(None)), stack)
+    # the dates are only registered once their data is written
+    array.attrs["dates"] = dates
+
+
+def read_layer(path, feature, date):
+    check_zarr()
+    array = zarr.open_array(os.path.join(path, feature), mode="r")
+    return array[list(array.attrs["dates"]).index(date)]
+
+
+def read_series(path, feature, rows=slice(None), cols=slice(None)):
+    # the sorted dates and the (date, y, x) values of a feature within a window of the tile
+    check_zarr()
+    array = zarr.open_array(os.path.join(path, feature), mode="r")
+    dates = list(array.attrs["dates"])
+    order = np.argsort(dates)
+    values = array[:, rows, cols]
+    return [dates[position] for position in order], values[order]
+
+
+def feature_profile(path, feature):
+    # crs and transform of a feature, to write a layer of the cube back to a GeoTIFF
+    check_zarr()
+    attrs = zarr.open_array(os.path.join(path, feature), mode="r").attrs
+    crs = rasterio.crs.CRS.from_wkt(attrs["crs"]) if attrs["crs"] else None
+    return crs, Affine(*attrs["transform"])
+
+
+def add_geotiffs(cube_folder, input_files, tile=None, date=None, feature=None):
+    # adds GeoTIFFs to the cubes of their tiles. tile, date and feature come from names like 00N_070W_2024-01-01_lastmonth.tif
+    # unless they are given, which lets the forest edge and smoothing outputs with other names be added as well
+    series = {}
+    for input_file in input_files:
+        match = LAYER_FILE.match(os.path.basename(input_file))
+        if match is None and None in (tile, date, feature):
+            raise ValueError(f"{input_file} is not named <tile>_<date>_<feature>.tif, give the tile, date and feature")
+        key = (tile or match.group(1), feature or match.group(3))
+        series.setdefault(key, []).append((date or match.group(2), input_file))
+    for (file_tile, file_feature), files in series.items():
+        layers = {}
+        for file_date, input_file in files:
+            with rasterio.open(input_file) as src:
+                layers[file_date] = src.read(1)
+                crs, transform = src.crs, src.transform
+        write_feature(cube_path(cube_folder, file_tile), file_feature, layers, crs, transform)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Add preprocessed GeoTIFFs to the per tile feature cubes.")
+    parser.add_argument("cube_folder", help="folder with the <tile>.zarr cubes, e.g. D:/ff-dev/results/preprocessed/cube")
+    parser.add_argument("input_files", nargs="+", help="GeoTIFFs named <tile>_<date>_<feature>.tif")
+    parser.add_argument("--tile", help="tile id of all input files", default=None, required=False)
+    parser.add_argument("--date", help="date (yyyy-mm-dd) of all input files", default=None, required=False)
+    parser.add_argument("--feature", help="feature name of all input files", default=None, required=False)
+    args = parser.parse_args()
+    add_geotiffs(args.cube_folder, args.input_files, args.tile, args.date, args.feature)
@@ -0,0 +1,187 @@
+import argparse
+import glob
+import os
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.warp import calculate_default_transform, reproject
+from rasterio.windows import Window
+from scipy.ndimage import binary_erosion, convolve
+from block_reduce import block_reduce, nearest_weights, weighted_rows
+from distance_engine import closeness, distance_strips
+from packed_mask import PackedMask
+from tile_dates import TileDate
+from tile_halo import TILE_ID
+
+# the forest edge features of a forest mask tile in one pass, instead of the chain of scripts in scripts_Stijn/Python
+# that wrote a full tile to disk after every step: the binary forest map (BinaryForestNonforestmaps_...py), the edge
+# map without the border pixels (ForestEdgeMap2.py, ForestEdgeMapSetbordervaluesto0.py), the closeness to the edges on
+# the 0.0004 degree grid summed to 0.004 degrees (ResampleForestEdge2.py, Distancetoforestedge3correct.py,
+# Distencetoforestedgeafterresamplingaggregating.py), the edge count at 0.0001 degrees summed to 0.004 degrees
+# (ForestEdgeDensity4...correct2.py), and the land mask on the grid of the landpercentage layer
+# (MultiplywithLand_..._ForestEdge.py). the forest mask is read in strips of output rows, only the 0.004 degree
+# layers are kept in memory and only the final closenesstoforestedge and forestedgedensity layers are written.
+# the closeness is summed on the grid of the first resampling to 0.0004 degrees, the second resampling of the chain to
+# the same resolution is left out: on whole tiles that grid is the same. the last column of the closeness, which the
+# aggregation script dropped and the land mask then left undefined, is kept
+
+# the 4-neighbours of a pixel, without the pixel itself
+CROSS = np.array([[0, 1, 0], [1, 0, 1], [0, 1, 0]])
+# rows around a strip that decide its edges: the erosion and the count of edge neighbours reach one row each
+EDGE_HALO = 2
+# the landpercentage value of pixels that are all land
+LAND = 254
+LAYERS = {"closeness": "closenesstoforestedge", "density": "forestedgedensity"}
+
+
+def grid(src, resolution):
+    # the transform, width and height of the bounds of src at resolution, like the scripts of the chain
+    return calculate_default_transform(src.crs, src.crs, src.width, src.height, *src.bounds, resolution=resolution)
+
+
+def nearest_pixels(source_size, size):
+    # the source pixel of every pixel of a nearest neighbour resampling of source_size pixels to size pixels over the
+    # same extent, like src.read(out_shape=...) in ResampleForestEdge2.py
+    return np.minimum(np.floor((np.arange(size) + 0.5) * source_size / size).astype(np.int64), source_size - 1)
+
+
+def land_multiplier(land_file):
+    with rasterio.open(land_file) as land:
+        return land.read(1) == LAND, land.meta.copy()
+
+
+class ForestEdgePipeline:
+    # the stages of the forest edge features with the settings of the scripts they replace. run() processes one tile
+    def __init__(self, threshold=1, edge_res=(0.0004, 0.0004), density_res=(0.0001, 0.0001), final_res=(0.004, 0.004), strip_cells=64):
+        self.threshold = threshold
+        self.edge_res = edge_res
+        self.density_res = density_res
+        self.final_res = final_res
+        self.strip_cells = strip_cells
+
+    def edges(self, src, first, last):
+        # the edge map of rows first:last of the forest mask: forest pixels (at least threshold) with a non-forest
+        # 4-neighbour that have at least two such pixels among their 4-neighbours, none on the border of the tile
+        top, bottom = max(0, first - EDGE_HALO), min(src.height, last + EDGE_HALO)
+        forest = src.read(1, window=Window(0, top, src.width, bottom - top)) >= self.threshold
+        potential = forest & ~binary_erosion(forest, structure=CROSS)
+        edges = (convolve(potential.view(np.uint8), CROSS, mode='constant', cval=0) >= 2) & potential
+        edges = edges[first - top:last - top]
+        if first == 0:
+            edges[0] = False
+        if last == src.height:
+            edges[-1] = False
+        edges[:, [0, -1]] = False
+        return edges
+
+    def resampled_edges(self, src, rows, cols):
+        # the edges of the source pixels rows x cols of a nearest neighbour resampling
+        edges = self.edges(src, rows[0], rows[-1] + 1)
+        return edges[rows - rows[0]][:, cols]
+
+    def density(self, src, first_block, last_block, row_weights, col_weights, block_cols):
+        # the edge pixels at density_res in the blocks first_block:last_block of final_res rows (see block_reduce.upsampled_block_sum)
+        blocks, sources, counts = row_weights
+        first, last = np.searchsorted(blocks, [first_block, last_block])
+        if first == last:
+            return np.zeros((last_block - first_block, block_cols), dtype=np.int64)
+        top = sources[first]
+        edges = self.edges(src, top, sources[last - 1] + 1).view(np.uint8)
+        rows = weighted_rows(edges, blocks[first:last] - first_block, sources[first:last] - top, counts[first:last], last_block - first_block)
+        return weighted_rows(rows.T, *col_weights, block_cols).T
+
+    def edge_grid(self, src, edge_rows, edge_cols, strip_rows):
+        # the edges of the edge_res grid as a bit packed mask, every source row read once
+        packed = PackedMask.zeros((len(edge_rows), len(edge_cols)))
+        for first in range(0, len(edge_rows), strip_rows):
+            rows = edge_rows[first:first + strip_rows]
+            packed.words[first:first + len(rows)] = np.packbits(self.resampled_edges(src, rows, edge_cols), axis=1)
+        return packed
+
+    def closeness(self, src, edge_rows, edge_cols, strip_rows):
+        # yields the first row and the uint8 closeness (see distance_engine.py) to the edges of every strip of
+        # strip_rows rows of the edge_res grid, 0 without any edge in the tile
+        edges = self.edge_grid(src, edge_rows, edge_cols, strip_rows)
+        for first, distances in distance_strips(edges.unpack, 0, len(edge_rows), strip_rows=strip_rows):
+            if distances is None:
+                yield first, np.zeros((min(strip_rows, len(edge_rows) - first), len(edge_cols)), dtype=np.uint8)
+            else:
+                yield first, closeness(distances)
+
+    def layers(self, forest_file):
+        # the closeness and density layers of the tile on the final_res grid, with their transform
+        with rasterio.open(forest_file) as src:
+            final_transform, final_width, final_height = grid(src, self.final_res)
+            _, edge_width, edge_height = grid(src, self.edge_res)
+            _, density_width, density_height = grid(src, self.density_res)
+            edge_rows = nearest_pixels(src.height, edge_height)
+            edge_cols = nearest_pixels(src.width, edge_width)
+            edge_factor = (int(round(self.final_res[1] / self.edge_res[1])), int(round(self.final_res[0] / self.edge_res[0])))
+            density_factor = (int(round(self.final_res[1] / self.density_res[1])), int(round(self.final_res[0] / self.density_res[0])))
+            row_weights = nearest_weights(src.height, src.res[1] / self.density_res[1], density_height, density_factor[0])
+            col_weights = nearest_weights(src.width, src.res[0] / self.density_res[0], density_width, density_factor[1])
+            density_cols = -(-density_width // density_factor[1])
+
+            layers = {name: np.zeros((final_height, final_width), dtype=np.float32) for name in LAYERS}
+            for first_row, strip in self.closeness(src, edge_rows, edge_cols, self.strip_cells * edge_factor[0]):
+                sums = block_reduce(strip, edge_factor, "sum", partial=True)
+                first_block = first_row // edge_factor[0]
+                layers["closeness"][first_block:first_block + sums.shape[0], :min(final_width, sums.shape[1])] = sums[:, :final_width]
+            for first_block in range(0, final_height, self.strip_cells):
+                last_block = min(first_block + self.strip_cells, final_height)
+                counts = self.density(src, first_block, last_block, row_weights, col_weights, density_cols)
+                layers["density"][first_block:last_block, :min(final_width, counts.shape[1])] = counts[:, :final_width]
+            return layers, final_transform, src.crs
+
+    def run(self, forest_file, prep_folder, date, land_file=None):
+        # writes <prep_folder>/input/<tile>/<tile>_<date>_closenesstoforestedge.tif and _forestedgedensity.tif. with a
+        # land_file (the landpercentage layer of the tile) they are on its grid and 0 where it is not all land
+        layers, transform, crs = self.layers(forest_file)
+        key = TileDate.from_string(TILE_ID.search(os.path.basename(forest_file)).group(0), date)
+        meta = {"driver": "GTiff", "count": 1, "crs": crs, "transform": transform,
+                "width": layers["closeness"].shape[1], "height": layers["closeness"].shape[0]}
+        if land_file is not None:
+            multiplier, meta = land_multiplier(land_file)
+            for name, layer in layers.items():
+                masked = np.zeros(multiplier.shape, dtype=np.float32)
+                reproject(source=layer, destination=masked, src_transform=transform, src_crs=crs,
+                          dst_transform=meta["transform"], dst_crs=meta["crs"], resampling=Resampling.nearest)
+                layers[name] = masked * multiplier
+        meta.update(dtype='float32', count=1, compress='LZW', nodata=-9999)
+        paths = []
+        for name, layer in layers.items():
+            path = key.layer_path(prep_folder, LAYERS[name])
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with rasterio.open(path, 'w', **meta) as dst:
+                dst.write(layer, 1)
+            paths.append(path)
+        return paths
+
+
+def find_land_file(prep_folder, tile):
+    files = sorted(glob.glob(os.path.join(prep_folder, "input", tile, f"{tile}_*_landpercentage.tif")))
+    return files[0] if files else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compute the forest edge closeness and density layers of forest mask tiles in one pass.')
+    parser.add_argument('forest_files', nargs='+', help='forest mask tiles with the tile id in their name, e.g. 00N_010E.tif')
+    parser.add_argument('--prep_folder', default='D:/ff-dev/results/preprocessed', help='preprocessed data folder, the layers go to input/<tile>/')
+    parser.add_argument('--date', default='2024-01-01', help='date (yyyy-mm-dd) of the layers')
+    parser.add_argument('--threshold', default=1, help='forest mask value from which a pixel is forest')
+    parser.add_argument('--land_mask', default=1, help='mask the layers with the landpercentage layer of the tile, tiles without it are skipped')
+    args = parser.parse_args()
+
+    pipeline = ForestEdgePipeline(threshold=float(args.threshold))
+    for forest_file in args.forest_files:
+        tile = TILE_ID.search(os.path.basename(forest_file)).group(0)
+        land_file = find_land_file(args.prep_folder, tile) if int(args.land_mask) == 1 else None
+        if int(args.land_mask) == 1 and land_file is None:
+            print(f"no landpercentage layer for {tile}, skipped")
+            continue
+        for path in pipeline.run(forest_file, args.prep_folder, args.date, land_file):
+            print(f"saved {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+import argparse
+import importlib.util
+import os
+import re
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime
+from dateutil.relativedelta import relativedelta
+import rasterio
+from ia_features import DEFAULT_MEMORY_BUDGET
+from ia_profile import PROFILE_LOG_ENV
+
+# python replacement of monthly_IA_processing_parallel.R: every worker process imports numpy, rasterio and GDAL once
+# and then processes whole tiles, all requested dates of a tile from a single read (see IA-processing_monthly.py)
+
+TILE_PATTERN = re.compile(r"^\d{2}[NS]_\d{3}[EW]\.tif$")
+_monthly_script = None
+
+
+def load_monthly_script():
+    # the processing script has a hyphen in its name, so it is loaded from its path once per worker
+    global _monthly_script
+    if _monthly_script is None:
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "IA-processing_monthly.py")
+        spec = importlib.util.spec_from_file_location("ia_processing_monthly", script)
+        _monthly_script = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(_monthly_script)
+    return _monthly_script
+
+
+def load_process_geotiff():
+    return load_monthly_script().process_geotiff
+
+
+def monthly_dates(min_date, max_date):
+    dates = []
+    date = datetime.strptime(min_date, "%Y-%m-%d")
+    while date <= datetime.strptime(max_date, "%Y-%m-%d"):
+        dates.append(date.strftime("%Y-%m-%d"))
+        date += relativedelta(months=1)
+    return dates
+
+
+def relative_date(date):
+    return (datetime.strptime(date, "%Y-%m-%d") - datetime(2015, 1, 1)).days
+
+
+def process_tile(input_file, prep_folder, dates, memory_budget, use_cache, halo=False, output_format="layers", strip_workers=1):
+    # dates is a list of dates, or a dict with the layers to (re)create of every date from the work plan of ia_planner.py
+    tile = os.path.basename(input_file)[:8]
+    for folder in ["input", "groundtruth"]:
+        os.makedirs(os.path.join(prep_folder, folder, tile), exist_ok=True)
+    planned_layers = {relative_date(date): layers for date, layers in dates.items()} if isinstance(dates, dict) else None
+    dates = sorted(dates)
+    output_file = os.path.join(prep_folder, "input", tile, f"{tile}_{dates[-1]}_layer.tif")
+    start = time.perf_counter()
+    load_process_geotiff()(input_file, output_file, [relative_date(date) for date in dates], None, 1, 1, 1, 1,
+                           memory_budget=memory_budget, use_cache=use_cache, halo=halo, output_format=output_format,
+                           planned_layers=planned_layers, strip_workers=strip_workers)
+    return time.perf_counter() - start
+
+
+def run_batch(input_files, prep_folder, dates, cores, memory_budget=DEFAULT_MEMORY_BUDGET, use_cache=False, halo=False, output_format="layers", strip_workers=None):
+    # dates is the list of dates of every tile, or a dict with the dates (see process_tile) of every input file.
+    # the tiles are started one by one as cores come free, every tile gets the free cores divided over the tiles that
+    # are still waiting for its strips, unless strip_workers is given. so the last tiles of a batch get the cores of
+    # the tiles that are done. largest tiles first, so the long ones do not start last and leave the other cores idle
+    pending = sorted(input_files, key=os.path.getsize, reverse=True)
+    input_files = list(pending)
+    running = {}
+    free = cores
+    timings = {}
+    failures = {}
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=cores) as executor:
+        while pending or running:
+            while pending and free > 0:
+                workers = strip_workers or max(1, free // len(pending))
+                input_file = pending.pop(0)
+                future = executor.submit(process_tile, input_file, prep_folder, dates[input_file] if isinstance(dates, dict) else dates, memory_budget, use_cache, halo, output_format, workers)
+                running[future] = (input_file, workers)
+                free -= workers
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                input_file, workers = running.pop(future)
+                free += workers
+                tile = os.path.basename(input_file)[:8]
+                try:
+                    timings[tile] = future.result()
+                    print(f"{tile} done in {timings[tile]:.1f} s")
+                except Exception as e:
+                    failures[tile] = e
+                    print(f"{tile} failed: {e}")
+    wall_time = time.perf_counter() - start
+
+    megapixels = 0
+    for input_file in input_files:
+        if os.path.basename(input_file)[:8] in timings:
+            with rasterio.open(input_file) as src:
+                megapixels += src.width * src.height / 1e6
+    print(f"processed {len(timings)} tiles in {wall_time:.1f} s, {len(failures)} failed")
+    if timings:
+        print(f"throughput: {len(timings) * 3600 / wall_time:.1f} tiles per hour, {megapixels / wall_time:.1f} megapixels per second")
+        for tile, seconds in sorted(timings.items(), key=lambda item: item[1], reverse=True):
+            print(f"  {tile} {seconds:.1f} s")
+    return timings, failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Process the integrated alert tiles of one or more dates with a pool of worker processes.")
+    parser.add_argument("-d", "--max-date", dest="max_date", default=datetime.today().strftime("%Y-%m-01"), help="Maximum date (default: first of the current month)")
+    parser.add_argument("--min-date", dest="min_date", default=None, help="process every first of the month from this date up to the maximum date (default: only the maximum date)")
+    parser.add_argument("--dates", default=None, help="comma separated list of dates to process instead of the min and max date")
+    parser.add_argument("-c", "--cores", default=9, help="Number of worker processes (default: 9)")
+    parser.add_argument("-i", "--input_folder", default="D:/ff-dev/alerts/", help="Location of the input folder that contains the GFW integrated alert tif files")
+    parser.add_argument("-p", "--prep_folder", default="D:/ff-dev/results/preprocessed/", help="Location of the preprocessed data folder")
+    parser.add_argument("-t", "--tiles", default=None, help="comma separated list of tile ids to process (default: all tiles in the input folder)")
+    parser.add_argument("--memory_budget", default=DEFAULT_MEMORY_BUDGET, help="memory budget in MB per worker for its row strips and the GDAL block cache (10%%), on top of the about 100 MB of python and its libraries.")
+    parser.add_argument("--use_cache", default=0, help="look the features up in the block date cache of the tiles, building it if needed")
+    parser.add_argument("--halo", default=0, help="smooth across tile borders with the neighbouring alert tiles in the input folder")
+    parser.add_argument("--output_format", default="layers", choices=["layers", "multiband", "cube"], help="one file per layer, all layers of a tile and date in one multiband file, or the zarr feature cube of the tile")
+    parser.add_argument("--strip_workers", default=None, help="worker processes per tile for its strips (default: the free cores divided over the tiles that are still waiting when the tile starts)")
+    parser.add_argument("--profile_log", default=None, help="every tile appends the seconds per stage and its peak memory to this .jsonl or .csv run log")
+    parser.add_argument("-dr", "--dryrun", default=0, help="only lists the tiles and dates that would be processed")
+    args = parser.parse_args()
+    if not os.path.isdir(args.input_folder): raise FileNotFoundError("input folder does not exist")
+    if not os.path.isdir(args.prep_folder): raise FileNotFoundError("preprocessed data folder does not exist")
+    # the worker processes inherit the run log through the environment
+    if args.profile_log: os.environ[PROFILE_LOG_ENV] = os.path.abspath(args.profile_log)
+
+    if args.dates:
+        dates = sorted(args.dates.split(","))
+    else:
+        dates = monthly_dates(args.min_date or args.max_date, args.max_date)
+    if args.tiles:
+        input_files = [os.path.join(args.input_folder, f"{tile}.tif") for tile in args.tiles.split(",")]
+    else:
+        input_files = [os.path.join(args.input_folder, file) for file in sorted(os.listdir(args.input_folder)) if TILE_PATTERN.match(file)]
+    print(f"processing {len(input_files)} tiles for {len(dates)} dates ({dates[0]} to {dates[-1]})")
+    if int(args.dryrun) != 1:
+        run_batch(input_files, args.prep_folder, dates, int(args.cores), float(args.memory_budget), int(args.use_cache) == 1, int(args.halo) == 1, args.output_format,
+                  int(args.strip_workers) if args.strip_workers is not None else None)
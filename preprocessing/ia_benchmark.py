@@ -0,0 +1,226 @@
+import argparse
+import importlib.util
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+from rasterio.windows import Window
+from ia_profile import peak_rss_mb
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# benchmarks the stages of the IA feature pipeline on synthetic integrated alert tiles, so a change can be measured
+# without a real 1.6 GB GFW tile. every stage runs in a fresh process and reports its time, peak memory and bytes
+# read and written to a json report, and once more in a fresh process under tracemalloc for the peak of its python
+# allocations, which would slow down the timed run. with a baseline report the stages that got slower are listed
+
+SCRIPT_FOLDER = os.path.dirname(os.path.abspath(__file__))
+STAGES = ["process_geotiff", "process_geotiff_dates", "block_reduce", "fused_block_features", "fun_patchiness", "weighted_smoothing"]
+# the relative date of the benchmarks (2023-06-01) and the first alert date of the synthetic tiles (2019-01-01)
+BENCHMARK_DATE = 3073
+FIRST_ALERT_DATE = 1461
+
+
+def make_alert_tile(path, size, occupied=0.3, density=0.05, seed=0, dtype="uint16"):
+    # writes a synthetic integrated alert tile of size x size pixels with confidence*10000 + days since 2015-01-01.
+    # like the real alerts the loss is clustered: a fraction of the 40x40 blocks is active, an active block has
+    # one event date with alerts within a few weeks of it, and a third of the tile is a region without any alerts
+    # that is never written, like the sparse blocks of the GFW tiles
+    rng = np.random.default_rng(seed)
+    block_rows = size // 40
+    active = rng.random((block_rows, block_rows)) < occupied
+    active[:, :block_rows // 3] = False
+    event = rng.integers(FIRST_ALERT_DATE, BENCHMARK_DATE + 60, (block_rows, block_rows))
+    profile = {"driver": "GTiff", "width": size, "height": size, "count": 1, "dtype": dtype, "crs": "EPSG:4326",
+               "transform": from_origin(0, 10, 10 / size, 10 / size), "tiled": True, "blockxsize": 400, "blockysize": 400,
+               "compress": "LZW", "sparse_ok": True}
+    with rasterio.open(path, "w", **profile) as dst:
+        for first_row in range(0, block_rows, 10):
+            rows = slice(first_row, min(first_row + 10, block_rows))
+            strip_active = np.repeat(np.repeat(active[rows], 40, axis=0), 40, axis=1)
+            strip_event = np.repeat(np.repeat(event[rows], 40, axis=0), 40, axis=1)
+            alerts = strip_active & (rng.random(strip_active.shape) < density)
+            dates = strip_event + rng.integers(0, 30, strip_active.shape)
+            confidence = rng.choice([2, 3, 4], size=strip_active.shape, p=[0.6, 0.3, 0.1])
+            data = np.where(alerts, confidence * 10000 + dates, 0).astype(dtype)
+            # only the columns with alerts are written, the others stay sparse
+            columns = np.flatnonzero(active[rows].any(axis=0))
+            if len(columns) > 0:
+                first_col, last_col = columns[0] * 40, (columns[-1] + 1) * 40
+                dst.write(data[:, first_col:last_col], 1, window=Window(first_col, first_row * 40, last_col - first_col, data.shape[0]))
+
+
+def load_script(name, file_name):
+    spec = importlib.util.spec_from_file_location(name, os.path.join(SCRIPT_FOLDER, file_name))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def bytes_io():
+    # bytes read and written by this process so far, None where the platform cannot tell
+    if psutil is not None:
+        counters = psutil.Process().io_counters()
+        return getattr(counters, "read_chars", counters.read_bytes), getattr(counters, "write_chars", counters.write_bytes)
+    if os.path.isfile("/proc/self/io"):
+        with open("/proc/self/io") as file:
+            counters = dict(line.split(": ") for line in file.read().splitlines())
+        return int(counters["rchar"]), int(counters["wchar"])
+    return None, None
+
+
+def stage_input(stage, tile_file):
+    # everything a stage needs that is not part of what is measured
+    if stage.startswith("process_geotiff"):
+        return None
+    with rasterio.open(tile_file) as src:
+        data = src.read(1)
+    if stage == "fused_block_features":
+        return data
+    dates = data % 10000
+    if stage in ["block_reduce", "fun_patchiness"]:
+        return (dates > BENCHMARK_DATE - 183) & (dates <= BENCHMARK_DATE)
+    return (dates <= BENCHMARK_DATE).reshape(data.shape[0] // 40, 40, data.shape[1] // 40, 40).sum(axis=(1, 3)).astype(float)
+
+
+def run_stage(stage, tile_file, num_windows, work_folder, traced=False):
+    # runs one stage in this (fresh) process and measures its time, memory and bytes read and written. with traced
+    # only the peak of its python allocations is measured: tracemalloc slows down every allocation, so it gets a run
+    # of its own and the timed run is not traced
+    from ia_features import BLOCK_FEATURES, BLOCK_SIZE, fun_patchiness, fused_block_features
+    from smoothing_engine import weighted_smoothing
+    from block_reduce import block_reduce
+    data = stage_input(stage, tile_file)
+    output_file = os.path.join(work_folder, "input", "00N_000E", "00N_000E_2023-06-01_layer.tif")
+    for folder in ["input", "groundtruth"]:
+        os.makedirs(os.path.join(work_folder, folder, "00N_000E"), exist_ok=True)
+    if stage.startswith("process_geotiff"):
+        monthly_script = load_script("ia_processing_monthly", "IA-processing_monthly.py")
+
+    def run():
+        if stage == "process_geotiff":
+            monthly_script.process_geotiff(tile_file, output_file, BENCHMARK_DATE, num_windows, 1, 1, 1, 1)
+        elif stage == "process_geotiff_dates":
+            # a year of monthly dates from one read of the tile
+            dates = [BENCHMARK_DATE - 365 + round(month * 365 / 12) for month in range(13)]
+            monthly_script.process_geotiff(tile_file, output_file, dates, num_windows, 1, 1, 1, 1)
+        elif stage == "block_reduce":
+            block_reduce(data, BLOCK_SIZE, "sum")
+        elif stage == "fused_block_features":
+            fused_block_features(data, BENCHMARK_DATE, BLOCK_FEATURES)
+        elif stage == "fun_patchiness":
+            fun_patchiness(data)
+        elif stage == "weighted_smoothing":
+            weighted_smoothing(data, window_size=31, exponent=1.5, quantile=0.17)
+
+    if traced:
+        tracemalloc.start()
+        run()
+        traced_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return {"traced_peak_mb": traced_peak / 1024 ** 2}
+
+    rss_before = peak_rss_mb()
+    read_before, written_before = bytes_io()
+    start = time.perf_counter()
+    run()
+    seconds = time.perf_counter() - start
+    read_after, written_after = bytes_io()
+    rss_after = peak_rss_mb()
+
+    output_bytes = sum(entry.stat().st_size for folder in ["input", "groundtruth"]
+                       for entry in os.scandir(os.path.join(work_folder, folder, "00N_000E")))
+    return {
+        "seconds": seconds,
+        "peak_rss_mb": rss_after,
+        "stage_rss_mb": None if rss_before is None else rss_after - rss_before,
+        "bytes_read": None if read_before is None else read_after - read_before,
+        "bytes_written": None if written_before is None else written_after - written_before,
+        "output_bytes": output_bytes,
+    }
+
+
+def run_fresh(*args):
+    # runs a stage in a fresh process, so the memory peak is that of the stage alone, and removes what it wrote
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        result = executor.submit(run_stage, *args).result()
+    shutil.rmtree(args[3], ignore_errors=True)
+    return result
+
+
+def run_benchmarks(sizes, window_counts, stages, repeats=1, keep_folder=None):
+    folder = keep_folder or tempfile.mkdtemp(prefix="ia_benchmark_")
+    os.makedirs(folder, exist_ok=True)
+    results = []
+    try:
+        for size in sizes:
+            tile_file = os.path.join(folder, f"synthetic_{size}.tif")
+            if not os.path.isfile(tile_file):
+                make_alert_tile(tile_file, size)
+            for stage in stages:
+                # only the windowed stages depend on the number of windows
+                for num_windows in (window_counts if stage.startswith("process_geotiff") else [None]):
+                    for repeat in range(repeats):
+                        work_folder = os.path.join(folder, f"{stage}_{size}_{num_windows}_{repeat}")
+                        # the timed run and the run under tracemalloc each in a fresh process
+                        result = run_fresh(stage, tile_file, num_windows, work_folder)
+                        result.update(run_fresh(stage, tile_file, num_windows, work_folder, True))
+                        result.update({"stage": stage, "tile_size": size, "num_windows": num_windows, "repeat": repeat,
+                                       "tile_bytes": os.path.getsize(tile_file)})
+                        results.append(result)
+                        print(f"{stage:24s} {size:6d} px  windows {str(num_windows):4s} {result['seconds']:8.3f} s  "
+                              f"peak {result['peak_rss_mb'] or 0:8.1f} MB")
+    finally:
+        if keep_folder is None:
+            shutil.rmtree(folder, ignore_errors=True)
+    return results
+
+
+def compare_reports(results, baseline, tolerance=0.2):
+    # the stages that take more than (1 + tolerance) times their fastest time in the baseline
+    def fastest(records):
+        times = {}
+        for record in records:
+            key = (record["stage"], record["tile_size"], record["num_windows"])
+            times[key] = min(times.get(key, float("inf")), record["seconds"])
+        return times
+    old, new = fastest(baseline), fastest(results)
+    return [(key, old[key], seconds) for key, seconds in sorted(new.items(), key=str) if key in old and seconds > old[key] * (1 + tolerance)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the IA feature pipeline on synthetic integrated alert tiles.")
+    parser.add_argument("--sizes", default="2000,8000", help="comma separated tile sizes in pixels, multiples of 40 (default: 2000,8000)")
+    parser.add_argument("--num_windows", default="1,4", help="comma separated window counts of the process_geotiff stages (default: 1,4)")
+    parser.add_argument("--stages", default=",".join(STAGES), help=f"comma separated stages out of {', '.join(STAGES)}")
+    parser.add_argument("--repeats", default=1, help="number of runs of every measurement")
+    parser.add_argument("--output", default="ia_benchmark.json", help="path of the json report")
+    parser.add_argument("--baseline", default=None, help="json report of an earlier run to compare against")
+    parser.add_argument("--tolerance", default=0.2, help="fraction a stage may be slower than the baseline (default: 0.2)")
+    parser.add_argument("--keep_folder", default=None, help="folder to keep the synthetic tiles in for the next run")
+    args = parser.parse_args()
+    results = run_benchmarks([int(size) for size in args.sizes.split(",")], [int(count) for count in args.num_windows.split(",")],
+                             args.stages.split(","), int(args.repeats), args.keep_folder)
+    report = {"created": datetime.now().isoformat(timespec="seconds"), "platform": platform.platform(),
+              "python": platform.python_version(), "numpy": np.__version__, "results": results}
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=1)
+    print(f"report written to {args.output}")
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare_reports(results, json.load(file)["results"], float(args.tolerance))
+        for (stage, size, num_windows), old, new in regressions:
+            print(f"slower: {stage} {size} px windows {num_windows}: {old:.3f} s -> {new:.3f} s")
+        if regressions:
+            raise SystemExit(1)
@@ -0,0 +1,103 @@
+import argparse
+import os
+import numpy as np
+import rasterio
+from ia_features import DATE_DIVISOR, DEFAULT_MEMORY_BUDGET, block_date_index, decode_alerts, gdal_cache_env, sparse_block_occupancy, strip_windows
+
+# a persistent per block date histogram of an integrated alert tile, stored next to the tile. it holds for every
+# 40x40 block the distinct alert dates with the number and summed confidence of the alerts on that date, from
+# which every count feature, timesinceloss and confidence of any date follow without reading the tile again
+
+
+def cache_path(input_file):
+    return os.path.splitext(input_file)[0] + "_blockdates.npz"
+
+
+def source_stamp(input_file):
+    # a re-downloaded alert tile changes size or modification time and thereby invalidates the cache
+    stat = os.stat(input_file)
+    return np.array([stat.st_size, stat.st_mtime])
+
+
+def build_block_date_cache(input_file, memory_budget=DEFAULT_MEMORY_BUDGET):
+    with gdal_cache_env(memory_budget), rasterio.open(input_file) as src:
+        shape = (src.height // 40, src.width // 40)
+        keys, counts, confidence = [], [], []
+        buffer = None
+        for window in strip_windows(src.width, src.height, memory_budget=memory_budget, occupancy=sparse_block_occupancy(src)):
+            if buffer is None or buffer.size < window.height * window.width: buffer = np.empty(window.height * window.width, dtype=src.dtypes[0])
+            data = src.read(1, window=window, out=buffer[:window.height * window.width].reshape(window.height, window.width))
+            index = block_date_index(decode_alerts(data))
+            # translate the blocks of the window to blocks of the tile
+            window_cols = window.width // 40
+            blocks = index["keys"] // DATE_DIVISOR
+            blocks = (window.row_off // 40 + blocks // window_cols) * shape[1] + window.col_off // 40 + blocks % window_cols
+            keys.append(blocks * DATE_DIVISOR + index["keys"] % DATE_DIVISOR)
+            counts.append(np.diff(index["count"]))
+            confidence.append(np.diff(index["confidence"]))
+    keys = np.concatenate(keys) if keys else np.zeros(0, dtype=np.int64)
+    counts = np.concatenate(counts) if counts else np.zeros(0)
+    confidence = np.concatenate(confidence) if confidence else np.zeros(0)
+    blocks = keys // DATE_DIVISOR
+    offsets = np.concatenate(([0], np.cumsum(np.bincount(blocks, minlength=shape[0] * shape[1]))))
+    np.savez_compressed(cache_path(input_file),
+                        shape=np.array(shape),
+                        stamp=source_stamp(input_file),
+                        offsets=offsets,
+                        dates=(keys % DATE_DIVISOR).astype(np.uint16),
+                        counts=counts.astype(np.uint16),
+                        confidence=confidence.astype(np.uint16))
+    return load_block_date_cache(input_file, rebuild=False)
+
+
+def load_block_date_cache(input_file, memory_budget=DEFAULT_MEMORY_BUDGET, rebuild=True):
+    # returns the cache of the tile as a block date index (see ia_features.block_date_index), building it
+    # first when it is missing or older than the tile
+    path = cache_path(input_file)
+    if os.path.isfile(path):
+        with np.load(path) as cache:
+            if np.array_equal(cache["stamp"], source_stamp(input_file)):
+                shape = tuple(int(size) for size in cache["shape"])
+                blocks = np.repeat(np.arange(shape[0] * shape[1], dtype=np.int64), np.diff(cache["offsets"]))
+                return {
+                    "shape": shape,
+                    "keys": blocks * DATE_DIVISOR + cache["dates"],
+                    "count": np.concatenate(([0], np.cumsum(cache["counts"], dtype=np.int64))),
+                    "confidence": np.concatenate(([0], np.cumsum(cache["confidence"], dtype=np.float64))),
+                }
+    if not rebuild:
+        raise FileNotFoundError(f"no up to date block date cache for {input_file}")
+    return build_block_date_cache(input_file, memory_budget)
+
+
+def cached_occupancy(input_file):
+    # the exact map of 40x40 blocks with alerts from an up to date cache, or None when there is none
+    path = cache_path(input_file)
+    if os.path.isfile(path):
+        with np.load(path) as cache:
+            if np.array_equal(cache["stamp"], source_stamp(input_file)):
+                return (np.diff(cache["offsets"]) > 0).reshape(tuple(int(size) for size in cache["shape"]))
+    return None
+
+
+def block_occupancy(input_file, src):
+    # the 40x40 blocks that can contain alerts: exact from the cache, otherwise from the sparse blocks
+    # of the GeoTIFF. None means every block has to be read
+    occupancy = cached_occupancy(input_file)
+    if occupancy is None:
+        occupancy = sparse_block_occupancy(src)
+    return occupancy
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the per block date histogram cache of integrated alert tiles.")
+    parser.add_argument("input_images", nargs="+", help="Paths to the integrated alert geotiffs")
+    parser.add_argument("--memory_budget", help="memory budget in MB for the row strips and the GDAL block cache (10%%), on top of the about 100 MB of python and its libraries.", default=DEFAULT_MEMORY_BUDGET, required=False)
+    parser.add_argument("--force", help="rebuild the cache even if it is up to date", default=0, required=False)
+    args = parser.parse_args()
+    for input_image in args.input_images:
+        if int(args.force) == 1:
+            build_block_date_cache(input_image, float(args.memory_budget))
+        else:
+            load_block_date_cache(input_image, float(args.memory_budget))
+        print(f"block date cache ready for {input_image}")
@@ -0,0 +1,332 @@
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+from scipy.ndimage import label
+from ia_profile import NO_TIMER, StageTimer
+
+# the integrated alerts store every pixel as confidence*10000 + days since 2015-01-01
+DATE_DIVISOR = 10000
+BLOCK_SIZE = 40
+# working memory of a window, measured as the peak of its block features: every pixel costs the raw uint32 read and
+# the patch density mask and labels, every alert pixel its decoded indices, values and block and the sort of the
+# block date index of several dates (about 82 bytes, 47 for a single date)
+BYTES_PER_PIXEL = 10
+BYTES_PER_ALERT = 96
+DEFAULT_MEMORY_BUDGET = 2048
+# GDAL keeps the blocks it reads and writes in its block cache, by default 5% of the RAM. every block of a tile is read
+# once, so the cache gets this share of the memory budget and the strips the rest
+GDAL_CACHE_SHARE = 0.1
+
+# count features as (lower, upper] day offsets relative to the relative date.
+# a lower bound of None means every alert up to the upper bound
+INTERVAL_FEATURES = {
+    "lastmonth": (-30, 0),
+    "lastthreemonths": (-92, 0),
+    "lastsixmonths": (-183, 0),
+    "previoussameseason": (-366, -183),
+    "totallossalerts": (None, 0),
+}
+# the groundtruth of a date counts the alerts in the months after it. it is made when processing the date
+# GROUNDTRUTH_MONTHS later, as the alerts in the (lower, upper] interval before that date, so every processed date
+# gives the labels of all horizons of the earlier dates from the same decode as its features
+GROUNDTRUTH_MONTHS = {"groundtruth1m": 1, "groundtruth3m": 3, "groundtruth6m": 6, "groundtruth12m": 12}
+GROUNDTRUTH_INTERVALS = {
+    "groundtruth1m": (-30, 0),
+    "groundtruth3m": (-92, 0),
+    "groundtruth6m": (-183, 0),
+    "groundtruth12m": (-366, 0),
+}
+COUNT_FEATURES = {**INTERVAL_FEATURES, **GROUNDTRUTH_INTERVALS}
+BLOCK_FEATURES = list(COUNT_FEATURES) + ["timesinceloss", "confidence", "patchdensity"]
+# value types of the block features: a 40x40 block holds at most 1600 alerts or patches and timesinceloss is at most 10000
+FEATURE_DTYPES = {**{name: "uint16" for name in COUNT_FEATURES}, "timesinceloss": "uint16", "confidence": "float32", "patchdensity": "uint16"}
+# internal tile size of the written layers
+OUTPUT_BLOCK_SIZE = 256
+
+
+def fun_patchiness(input_array, block_size=BLOCK_SIZE):
+    # counts the connected patches per 40x40 block with a single label call over the whole window.
+    # the blocks are stacked on top of each other with a zero row in between, so no patch can cross
+    # a block boundary and the raster order labelling numbers the patches block by block
+    if input_array.ndim == 3:
+        input_array = input_array[0]
+    rows = input_array.shape[0] // block_size
+    cols = input_array.shape[1] // block_size
+    stacked = np.zeros((rows * cols, block_size + 1, block_size), dtype=bool)
+    stacked[:, :block_size, :] = (input_array[:rows * block_size, :cols * block_size]
+                                  .reshape(rows, block_size, cols, block_size)
+                                  .transpose(0, 2, 1, 3)
+                                  .reshape(rows * cols, block_size, block_size))
+    labels = label(stacked.reshape(rows * cols * (block_size + 1), block_size))[0]
+    # the highest label seen up to and including a block minus the one before it is its patch count
+    highest = np.maximum.accumulate(labels.reshape(rows * cols, -1).max(axis=1))
+    output_array = np.diff(highest, prepend=0).reshape(rows, cols).astype(float)
+    return output_array
+
+
+def layer_profile(dtype):
+    # creation options of the feature layers: tiled LZW with the horizontal differencing predictor for integers
+    # and the floating point predictor for floats, so neighbouring blocks with similar values compress well
+    return {
+        "driver": "GTiff",
+        "compress": "LZW",
+        "predictor": 3 if np.dtype(dtype).kind == "f" else 2,
+        "tiled": True,
+        "blockxsize": OUTPUT_BLOCK_SIZE,
+        "blockysize": OUTPUT_BLOCK_SIZE,
+    }
+
+
+def gdal_cache_env(memory_budget):
+    # a rasterio environment with the GDAL block cache capped at its share of the memory budget in MB. rasterio sets
+    # GDAL_CACHEMAX in bytes and restores the previous cap when it is left
+    return rasterio.Env(GDAL_CACHEMAX=max(1, int(memory_budget * GDAL_CACHE_SHARE)) * 1024 ** 2)
+
+
+def budget_strips(width, block_rows, memory_budget, block_size=BLOCK_SIZE, occupancy=None):
+    # the (first block row, number of block rows) of the strips that fit in the memory budget in MB, without the share
+    # of the GDAL block cache. without a block occupancy map every pixel can be an alert, with one only the pixels of
+    # the blocks with alerts
+    memory_budget *= 1 - GDAL_CACHE_SHARE
+    alert_blocks = np.full(block_rows, width // block_size) if occupancy is None else occupancy.sum(axis=1)
+    row_bytes = width * block_size * BYTES_PER_PIXEL + alert_blocks * block_size ** 2 * BYTES_PER_ALERT
+    strips = []
+    first, used = 0, 0
+    for row in range(block_rows):
+        if row > first and used + row_bytes[row] > memory_budget * 1024 ** 2:
+            strips.append((first, row - first))
+            first, used = row, 0
+        used += row_bytes[row]
+    if block_rows > first:
+        strips.append((first, block_rows - first))
+    return strips
+
+
+def strip_windows(width, height, memory_budget=DEFAULT_MEMORY_BUDGET, num_windows=None, block_size=BLOCK_SIZE, occupancy=None):
+    # yields full width row strips aligned to the 40 pixel blocks. the strip heights follow from the memory
+    # budget in MB, or from num_windows when that is given. a trailing partial block row or column is skipped.
+    # with a block occupancy map the strips without alerts are skipped and the others cropped to their alert columns
+    block_rows = height // block_size
+    if num_windows:
+        rows_per_strip = max(1, min(-(-block_rows // int(num_windows)), block_rows))
+        strips = [(first_row, min(rows_per_strip, block_rows - first_row)) for first_row in range(0, block_rows, rows_per_strip)]
+    else:
+        strips = budget_strips(width, block_rows, memory_budget, block_size, occupancy)
+    for first_row, nrows in strips:
+        first_col, ncols = 0, width // block_size
+        if occupancy is not None:
+            columns = np.flatnonzero(occupancy[first_row:first_row + nrows].any(axis=0))
+            if len(columns) == 0:
+                continue
+            first_col, ncols = int(columns[0]), int(columns[-1] - columns[0] + 1)
+        yield Window(first_col * block_size, first_row * block_size, ncols * block_size, nrows * block_size)
+
+
+def sparse_block_occupancy(src, block_size=BLOCK_SIZE):
+    # marks the 40x40 blocks that overlap an internal block of the GeoTIFF with data. internal blocks that were
+    # never written (sparse files) have no offset. returns None when the file has no empty internal blocks
+    block_height, block_width = src.block_shapes[0]
+    internal_rows = -(-src.height // block_height)
+    internal_cols = -(-src.width // block_width)
+    written = np.array([[src.get_tag_item(f"BLOCK_OFFSET_{x}_{y}", "TIFF", bidx=1) is not None
+                         for x in range(internal_cols)] for y in range(internal_rows)])
+    if written.all():
+        return None
+    # count the written internal blocks under every 40x40 block with an integral image of the internal block grid
+    integral = np.pad(written.cumsum(axis=0).cumsum(axis=1), ((1, 0), (1, 0)))
+    first_y = np.arange(src.height // block_size) * block_size // block_height
+    last_y = (np.arange(src.height // block_size) * block_size + block_size - 1) // block_height + 1
+    first_x = np.arange(src.width // block_size) * block_size // block_width
+    last_x = (np.arange(src.width // block_size) * block_size + block_size - 1) // block_width + 1
+    written_below = (integral[last_y][:, last_x] - integral[first_y][:, last_x]
+                     - integral[last_y][:, first_x] + integral[first_y][:, first_x])
+    return written_below > 0
+
+
+def decode_alerts(data, block_size=BLOCK_SIZE):
+    # decodes only the nonzero pixels of a window, once, into their date, confidence and block index
+    if data.ndim == 3:
+        data = data[0]
+    rows = data.shape[0] // block_size
+    cols = data.shape[1] // block_size
+    data = data[:rows * block_size, :cols * block_size]
+    # int32 indices take half the memory of the int64 ones of nonzero, a window is far below 2**31 pixels per side
+    iy, ix = np.nonzero(data)
+    iy, ix = iy.astype(np.int32), ix.astype(np.int32)
+    values = data[iy, ix]
+    alerts = {
+        "shape": (rows, cols),
+        "iy": iy,
+        "ix": ix,
+        "date": values % DATE_DIVISOR,
+        "confidence": values // DATE_DIVISOR,
+        "block": (iy // block_size) * cols + ix // block_size,
+    }
+    return alerts
+
+
+def interval_counts(alerts, relative_date, intervals):
+    # counts the alerts per block for every (lower, upper] interval with one histogram over the interval edges
+    nblocks = alerts["shape"][0] * alerts["shape"][1]
+    bounds = {name: (0 if lower is None else relative_date + lower, relative_date + upper)
+              for name, (lower, upper) in intervals.items()}
+    edges = np.unique([edge for bound in bounds.values() for edge in bound])
+    nbins = len(edges) + 1
+    # bin k holds the dates in (edges[k-1], edges[k]]
+    bins = np.searchsorted(edges, alerts["date"], side="left")
+    histogram = np.bincount(alerts["block"] * nbins + bins, minlength=nblocks * nbins).reshape(nblocks, nbins)
+    # cumulative[:, k] is the number of alerts with a date up to and including edges[k]
+    cumulative = np.cumsum(histogram, axis=1)
+    counts = {}
+    for name, (lower, upper) in bounds.items():
+        counts[name] = cumulative[:, np.searchsorted(edges, upper)] - cumulative[:, np.searchsorted(edges, lower)]
+    return counts
+
+
+def patch_density(alerts, relative_date, block_size=BLOCK_SIZE):
+    # for now patchiness uses 6 months as well.
+    rows, cols = alerts["shape"]
+    lower, upper = INTERVAL_FEATURES["lastsixmonths"]
+    recent = (alerts["date"] > relative_date + lower) & (alerts["date"] <= relative_date + upper)
+    mask = np.zeros((rows * block_size, cols * block_size), dtype=bool)
+    mask[alerts["iy"][recent], alerts["ix"][recent]] = True
+    return fun_patchiness(mask, block_size)
+
+
+def time_since_loss(latest, relative_date):
+    # timesinceloss from the latest alert date up to the relative date of every block, 0 for blocks without alerts.
+    # it is the same arithmetic as on the full resolution dates, the block maximum commutes with it, so the latest
+    # dates can come from anywhere: a block maximum of the date plane, the block date cache or the decoded alerts
+    return np.multiply(np.divide(latest, relative_date), 10000).astype(int)
+
+
+def fused_block_features(data, relative_date, features, block_size=BLOCK_SIZE, timer=NO_TIMER):
+    # computes all requested 40x40 block aggregates of a window from a single decode of the alert values.
+    # the results are identical to running block_reduce once per feature on the full resolution data.
+    # the count features share one histogram and are timed together
+    with timer.stage("decode"):
+        alerts = decode_alerts(data, block_size)
+    rows, cols = alerts["shape"]
+    nblocks = rows * cols
+    results = {}
+
+    intervals = {name: COUNT_FEATURES[name] for name in features if name in COUNT_FEATURES}
+    if intervals:
+        with timer.stage("feature:counts"):
+            for name, counts in interval_counts(alerts, relative_date, intervals).items():
+                results[name] = counts.reshape(rows, cols).astype(float)
+
+    if "timesinceloss" in features:
+        with timer.stage("feature:timesinceloss"):
+            past = alerts["date"] <= relative_date
+            latest = np.zeros(nblocks, dtype=np.uint16)
+            np.maximum.at(latest, alerts["block"][past], alerts["date"][past])
+            results["timesinceloss"] = time_since_loss(latest, relative_date).reshape(rows, cols).astype(float)
+
+    if "confidence" in features:
+        with timer.stage("feature:confidence"):
+            past = alerts["date"] < relative_date
+            total = np.bincount(alerts["block"][past], weights=alerts["confidence"][past], minlength=nblocks)
+            results["confidence"] = (total / (block_size * block_size)).reshape(rows, cols)
+
+    if "patchdensity" in features:
+        with timer.stage("feature:patchdensity"):
+            results["patchdensity"] = patch_density(alerts, relative_date, block_size)
+
+    return results
+
+
+def block_date_index(alerts):
+    # a per block cumulative histogram over the alert dates: the sorted unique block*10000+date keys with
+    # the running number and confidence of the alerts up to each key. any per block question about the
+    # alerts up to a date is then a binary search of block*10000+date in the keys and two lookups
+    rows, cols = alerts["shape"]
+    keys = alerts["block"].astype(np.int64) * DATE_DIVISOR + alerts["date"]
+    keys, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+    confidence = np.bincount(inverse, weights=alerts["confidence"], minlength=len(keys))
+    index = {
+        "shape": (rows, cols),
+        "keys": keys,
+        # leading zero so that the value up to a search position can be looked up directly
+        "count": np.concatenate(([0], np.cumsum(counts))),
+        "confidence": np.concatenate(([0], np.cumsum(confidence))),
+    }
+    return index
+
+
+def alerts_upto(index, date, side="right"):
+    # search position of every block that follows its alerts up to the date (right) or before it (left)
+    starts = np.arange(index["shape"][0] * index["shape"][1], dtype=np.int64) * DATE_DIVISOR
+    return np.searchsorted(index["keys"], starts + max(int(date), 0), side=side)
+
+
+def latest_dates(index, relative_date):
+    # the latest alert date up to and including the relative date of every block of a block date index, 0 without alerts
+    if len(index["keys"]) == 0:
+        return np.zeros(index["shape"], dtype=np.uint16)
+    first = alerts_upto(index, 0, side="left")
+    last = alerts_upto(index, relative_date)
+    latest = np.where(last > first, index["keys"][last - 1] % DATE_DIVISOR, 0).astype(np.uint16)
+    return latest.reshape(index["shape"])
+
+
+def index_features(index, relative_date, features, block_size=BLOCK_SIZE, timer=NO_TIMER):
+    # derives the block features of one relative date from a block date index, patchdensity needs the pixels
+    rows, cols = index["shape"]
+    first = alerts_upto(index, 0, side="left")
+    results = {}
+    for name in features:
+        if name in COUNT_FEATURES:
+            with timer.stage(f"feature:{name}"):
+                lower, upper = COUNT_FEATURES[name]
+                lower = 0 if lower is None else relative_date + lower
+                counts = index["count"][alerts_upto(index, relative_date + upper)] - index["count"][alerts_upto(index, lower)]
+                results[name] = counts.reshape(rows, cols).astype(float)
+
+    if "timesinceloss" in features:
+        with timer.stage("feature:timesinceloss"):
+            results["timesinceloss"] = time_since_loss(latest_dates(index, relative_date), relative_date).astype(float)
+
+    if "confidence" in features:
+        with timer.stage("feature:confidence"):
+            total = index["confidence"][alerts_upto(index, relative_date, side="left")] - index["confidence"][first]
+            results["confidence"] = (total / (block_size * block_size)).reshape(rows, cols)
+
+    return results
+
+
+def block_features_for_dates(data, relative_dates, features, block_size=BLOCK_SIZE, timer=NO_TIMER):
+    # computes the block features of many relative dates from a single decode and sort of the window,
+    # every extra date only costs a few binary searches per block. features maps every date to its feature list
+    with timer.stage("decode"):
+        alerts = decode_alerts(data, block_size)
+    with timer.stage("index"):
+        index = block_date_index(alerts)
+    results = {}
+    for relative_date in relative_dates:
+        results[relative_date] = index_features(index, relative_date, features[relative_date], block_size, timer)
+        if "patchdensity" in features[relative_date]:
+            with timer.stage("feature:patchdensity"):
+                results[relative_date]["patchdensity"] = patch_density(alerts, relative_date, block_size)
+    return results
+
+
+def window_block_features(data, features, block_size=BLOCK_SIZE, timer=NO_TIMER):
+    # the block features {date: {feature: values}} of a window, features maps every relative date to its feature list.
+    # a single date is derived directly from the decoded alerts, several dates through a block date index
+    if len(features) == 1:
+        date = next(iter(features))
+        return {date: fused_block_features(data, date, features[date], block_size, timer)}
+    return block_features_for_dates(data, list(features), features, block_size, timer)
+
+
+def read_strip_features(input_file, window, features, block_size=BLOCK_SIZE, timed=False, memory_budget=DEFAULT_MEMORY_BUDGET):
+    # reads one strip of an alert tile and returns its block features, with the seconds of its stages and the peak
+    # memory of the worker when timed. runs in the worker processes that share a tile, so every call opens its own
+    # dataset: a GDAL handle cannot be shared between processes. memory_budget is the share of the worker
+    timer = StageTimer(timed=timed)
+    with timer.stage("read"):
+        with gdal_cache_env(memory_budget), rasterio.open(input_file) as src:
+            data = src.read(1, window=window)
+    blocks = window_block_features(data, features, block_size, timer)
+    return window, blocks, timer.stages, timer.stop()
@@ -0,0 +1,218 @@
+import argparse
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import repeat
+import numpy as np
+from ia_batch import TILE_PATTERN, load_monthly_script, monthly_dates, run_batch
+from ia_cache import load_block_date_cache, source_stamp
+from feature_cube import cube_features, feature_dates
+from ia_features import DATE_DIVISOR, DEFAULT_MEMORY_BUDGET
+from ia_profile import PROFILE_LOG_ENV
+from tile_dates import TileDate
+
+# plans the IA processing from a single scan of the preprocessed tree instead of probing every expected file.
+# the manifest in the preprocessed folder records the size and modification time of every alert tile the outputs were
+# made from, with a digest of its alerts per month. when a tile is downloaded again only the outputs of the dates
+# from the first month whose alerts changed are redone: the features of a date only depend on the alerts up to it.
+# with --halo the smoothed layers also depend on the neighbouring tiles, which the manifest does not follow.
+# the digests take a full read of a tile, so they are made by a pool of worker processes and only for the tiles that
+# were downloaded again or processed. tiles that are up to date without a record only get their size and time: when
+# they are downloaded again all their dates are redone. a dry run reads no tiles and lists all dates of the tiles that
+# were downloaded again
+
+OUTPUT_FILE = re.compile(r"^(\d{2}[NS]_\d{3}[EW])_(\d{4}-\d{2}-\d{2})_([a-z0-9]+)\.tif$")
+CUBE_FILE = re.compile(r"^(\d{2}[NS]_\d{3}[EW])\.zarr$")
+MANIFEST = "manifest.json"
+
+
+def scan_outputs(prep_folder, output_format="layers", layers=(), groundtruth_months=None):
+    # the (tile, date, layer) of every output in one pass over the tree: the layer files of the input and groundtruth
+    # folders, the layers of the multiband features files, or the layers and dates in the feature cubes of the tiles
+    outputs = set()
+    if output_format == "cube":
+        root = os.path.join(prep_folder, "cube")
+        for entry in (os.scandir(root) if os.path.isdir(root) else []):
+            match = CUBE_FILE.match(entry.name)
+            if match is not None:
+                for layer in cube_features(entry.path):
+                    outputs.update((match.group(1), date, layer) for date in feature_dates(entry.path, layer))
+        return outputs
+    for folder in ["input", "groundtruth"]:
+        root = os.path.join(prep_folder, folder)
+        if not os.path.isdir(root):
+            continue
+        for tile_folder in os.scandir(root):
+            if not tile_folder.is_dir():
+                continue
+            for entry in os.scandir(tile_folder.path):
+                match = OUTPUT_FILE.match(entry.name)
+                if match is None:
+                    continue
+                tile, date, layer = match.groups()
+                if output_format == "multiband" and layer == "features":
+                    # the features file of a date holds all its layers, the groundtruth of the earlier dates included
+                    key = TileDate.from_string(tile, date)
+                    outputs.update((tile, key.shifted(-(groundtruth_months or {}).get(name, 0)).date_string, name) for name in layers)
+                elif output_format == "layers":
+                    outputs.add((tile, date, layer))
+    return outputs
+
+
+def required_outputs(tiles, dates, layers, groundtruth_months):
+    # every (tile, date, layer) the dates need, with the date the tile has to be processed at to create it. the
+    # groundtruth of a date is made when processing the date months later, and only when that is not beyond the last date
+    required = {}
+    for tile in tiles:
+        last_key = TileDate.from_string(tile, dates[-1])
+        for date in dates:
+            key = TileDate.from_string(tile, date)
+            for layer in layers:
+                process_key = key.shifted(groundtruth_months.get(layer, 0))
+                if process_key.date <= last_key.date:
+                    required[(tile, date, layer)] = process_key.date_string
+    return required
+
+
+def mix(values):
+    # the splitmix64 finaliser, a cheap well spread 64 bit hash of every value
+    values = values.astype(np.uint64)
+    values ^= values >> np.uint64(30)
+    values *= np.uint64(0xbf58476d1ce4e5b9)
+    values ^= values >> np.uint64(27)
+    values *= np.uint64(0x94d049bb133111eb)
+    values ^= values >> np.uint64(31)
+    return values
+
+
+def month_digests(index):
+    # an order independent digest per month of the alerts in a block date index (see ia_features.block_date_index)
+    # that changes with any alert that is added, removed, moved or changes its confidence
+    counts = np.diff(index["count"]).astype(np.uint64)
+    confidence = np.diff(index["confidence"]).astype(np.uint64)
+    digests = mix(mix(index["keys"]) ^ (counts << np.uint64(32) | confidence))
+    days = (index["keys"] % DATE_DIVISOR).astype("timedelta64[D]")
+    months, inverse = np.unique((np.datetime64("2015-01-01") + days).astype("datetime64[M]"), return_inverse=True)
+    sums = np.zeros(len(months), dtype=np.uint64)
+    np.add.at(sums, inverse, digests)
+    return {str(month): f"{value:016x}" for month, value in zip(months, sums)}
+
+
+def first_changed_date(old_months, new_months):
+    changed = [month for month in set(old_months) | set(new_months) if old_months.get(month) != new_months.get(month)]
+    return f"{min(changed)}-01" if changed else None
+
+
+def load_manifest(prep_folder):
+    path = os.path.join(prep_folder, MANIFEST)
+    if not os.path.isfile(path):
+        return {"tiles": {}}
+    with open(path) as file:
+        return json.load(file)
+
+
+def save_manifest(prep_folder, manifest):
+    # written to a temporary file first so an interrupted run never leaves a broken manifest
+    path = os.path.join(prep_folder, MANIFEST)
+    with open(path + ".tmp", "w") as file:
+        json.dump(manifest, file)
+    os.replace(path + ".tmp", path)
+
+
+def tile_record(input_file, memory_budget=DEFAULT_MEMORY_BUDGET):
+    return {"stamp": source_stamp(input_file).tolist(),
+            "months": month_digests(load_block_date_cache(input_file, memory_budget))}
+
+
+def tile_records(input_files, cores, memory_budget=DEFAULT_MEMORY_BUDGET):
+    # the records of the tiles, read and digested by a pool of worker processes
+    if not input_files:
+        return {}
+    with ProcessPoolExecutor(max_workers=min(cores, len(input_files))) as executor:
+        records = executor.map(tile_record, input_files, repeat(memory_budget))
+        return {os.path.basename(input_file)[:8]: record for input_file, record in zip(input_files, records)}
+
+
+def plan_work(input_files, prep_folder, dates, memory_budget=DEFAULT_MEMORY_BUDGET, cores=1, dryrun=False, output_format="layers"):
+    # returns the work plan {input file: {date: [layers]}} with the missing and invalidated outputs, and the new
+    # manifest records of the tiles that were downloaded again. in a dry run these are not read and all their dates
+    # are planned
+    monthly_script = load_monthly_script()
+    manifest = load_manifest(prep_folder)
+    existing = scan_outputs(prep_folder, output_format, list(monthly_script.LAYERS), monthly_script.GROUNDTRUTH_MONTHS)
+    tiles = {os.path.basename(input_file)[:8]: input_file for input_file in input_files}
+    required = required_outputs(list(tiles), dates, list(monthly_script.LAYERS), monthly_script.GROUNDTRUTH_MONTHS)
+
+    downloaded = [input_file for tile, input_file in tiles.items()
+                  if tile in manifest["tiles"] and manifest["tiles"][tile]["stamp"] != source_stamp(input_file).tolist()]
+    records = {} if dryrun else tile_records(downloaded, cores, memory_budget)
+    changed_from = {}
+    for input_file in downloaded:
+        tile = os.path.basename(input_file)[:8]
+        old_months = manifest["tiles"][tile]["months"]
+        if tile in records and old_months is not None:
+            changed_from[tile] = first_changed_date(old_months, records[tile]["months"])
+        else:
+            changed_from[tile] = dates[0]
+
+    work = {}
+    for (tile, date, layer), process_date in required.items():
+        invalid = changed_from.get(tile) is not None and process_date >= changed_from[tile]
+        if invalid or (tile, date, layer) not in existing:
+            work.setdefault(tiles[tile], {}).setdefault(process_date, []).append(layer)
+    return work, records
+
+
+def update_manifest(prep_folder, input_files, records, processed, cores=1, memory_budget=DEFAULT_MEMORY_BUDGET):
+    # records the alert tiles that the outputs are now made from. the processed tiles without a record with digests
+    # get one, the tiles without work only their stamp when they have no record at all
+    manifest = load_manifest(prep_folder)
+    processed = {os.path.basename(input_file)[:8] for input_file in processed}
+    missing = [input_file for input_file in input_files if os.path.basename(input_file)[:8] in processed
+               and os.path.basename(input_file)[:8] not in records
+               and manifest["tiles"].get(os.path.basename(input_file)[:8], {}).get("months") is None]
+    records = {**records, **tile_records(missing, cores, memory_budget)}
+    for input_file in input_files:
+        tile = os.path.basename(input_file)[:8]
+        if tile in records:
+            manifest["tiles"][tile] = records[tile]
+        elif tile not in manifest["tiles"]:
+            manifest["tiles"][tile] = {"stamp": source_stamp(input_file).tolist(), "months": None}
+    save_manifest(prep_folder, manifest)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Process only the missing or outdated integrated alert layers of a range of dates.")
+    parser.add_argument("-d", "--max-date", dest="max_date", default=datetime.today().strftime("%Y-%m-01"), help="Maximum date (default: first of the current month)")
+    parser.add_argument("--min-date", dest="min_date", default="2021-01-01", help="first date that needs all layers (default: 2021-01-01)")
+    parser.add_argument("-c", "--cores", default=9, help="Number of worker processes (default: 9)")
+    parser.add_argument("-i", "--input_folder", default="D:/ff-dev/alerts/", help="Location of the input folder that contains the GFW integrated alert tif files")
+    parser.add_argument("-p", "--prep_folder", default="D:/ff-dev/results/preprocessed/", help="Location of the preprocessed data folder")
+    parser.add_argument("-t", "--tiles", default=None, help="comma separated list of tile ids to process (default: all tiles in the input folder)")
+    parser.add_argument("--memory_budget", default=DEFAULT_MEMORY_BUDGET, help="memory budget in MB per worker for its row strips and the GDAL block cache (10%%), on top of the about 100 MB of python and its libraries.")
+    parser.add_argument("--use_cache", default=0, help="look the features up in the block date cache of the tiles")
+    parser.add_argument("--output_format", default="layers", choices=["layers", "multiband", "cube"], help="one file per layer, all layers of a tile and date in one multiband file, or the zarr feature cube of the tile")
+    parser.add_argument("--profile_log", default=None, help="every tile appends the seconds per stage and its peak memory to this .jsonl or .csv run log")
+    parser.add_argument("-dr", "--dryrun", default=0, help="only prints the work plan")
+    args = parser.parse_args()
+    if not os.path.isdir(args.input_folder): raise FileNotFoundError("input folder does not exist")
+    if not os.path.isdir(args.prep_folder): raise FileNotFoundError("preprocessed data folder does not exist")
+    if args.profile_log: os.environ[PROFILE_LOG_ENV] = os.path.abspath(args.profile_log)
+
+    if args.tiles:
+        input_files = [os.path.join(args.input_folder, f"{tile}.tif") for tile in args.tiles.split(",")]
+    else:
+        input_files = [os.path.join(args.input_folder, file) for file in sorted(os.listdir(args.input_folder)) if TILE_PATTERN.match(file)]
+    memory_budget = float(args.memory_budget)
+    work, records = plan_work(input_files, args.prep_folder, monthly_dates(args.min_date, args.max_date), memory_budget, int(args.cores), int(args.dryrun) == 1, args.output_format)
+    print(f"{len(work)} of {len(input_files)} tiles need processing, {sum(len(dates) for dates in work.values())} tile dates, "
+          f"{sum(len(layers) for dates in work.values() for layers in dates.values())} layers")
+    for input_file, dates in sorted(work.items()):
+        print(f"  {os.path.basename(input_file)[:8]}: {', '.join(sorted(dates))}")
+    if int(args.dryrun) != 1:
+        timings, failures = run_batch(list(work), args.prep_folder, work, int(args.cores), memory_budget, int(args.use_cache) == 1, output_format=args.output_format) if work else ({}, {})
+        # the tiles without work are up to date as they are, failed tiles keep their old record and are planned again
+        done = [input_file for input_file in input_files if os.path.basename(input_file)[:8] not in failures]
+        update_manifest(args.prep_folder, done, records, list(work), int(args.cores), memory_budget)
@@ -0,0 +1,162 @@
+import csv
+import io
+import json
+import os
+import platform
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from datetime import datetime
+try:
+    import resource
+except ImportError:
+    resource = None
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# opt in timing of the stages of the IA processing. with a run log, given as --profile_log or in the IA_PROFILE_LOG
+# environment variable, every processed tile appends one record with the seconds spent in every stage and the peak
+# memory of the tile to the log: a json line, or rows of tile, stage and seconds when the log ends with .csv.
+# several worker processes can append to the same log. without a log the stages are not timed at all.
+# the peak memory is sampled by a thread while the timer of the tile runs, so in a worker that processes many tiles it
+# is the peak of every tile and not of the process so far. the strip workers sample their own memory and the largest
+# peak of the tile or one of its workers is logged
+
+PROFILE_LOG_ENV = "IA_PROFILE_LOG"
+CSV_FIELDS = ["time", "script", "tile", "dates", "stage", "seconds", "peak_rss_mb"]
+SAMPLE_SECONDS = 0.05
+# the timers that are running in this process and the thread that samples the memory for them
+_sampled = weakref.WeakSet()
+_sampler = None
+_sampler_lock = threading.Lock()
+
+
+def peak_rss_mb():
+    # the peak resident memory of this process so far (see ia_benchmark.py), None where the platform cannot tell
+    if resource is not None:
+        # kilobytes on linux, bytes on mac
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 ** 2 if platform.system() == "Darwin" else 1024)
+    if psutil is not None:
+        return psutil.Process().memory_info().peak_wset / 1024 ** 2
+    return None
+
+
+def current_rss_mb():
+    # the resident memory of this process now, None where the platform cannot tell
+    if os.path.isfile("/proc/self/statm"):
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 ** 2
+    if psutil is not None:
+        return psutil.Process().memory_info().rss / 1024 ** 2
+    return None
+
+
+def sample_rss():
+    # adds the memory of the process to every running timer until none is left
+    global _sampler
+    while True:
+        rss = current_rss_mb()
+        with _sampler_lock:
+            timers = list(_sampled)
+            if not timers or rss is None:
+                _sampler = None
+                return
+        for timer in timers:
+            timer.add_peak(rss)
+        del timers
+        time.sleep(SAMPLE_SECONDS)
+
+
+def start_sampling(timer):
+    global _sampler
+    with _sampler_lock:
+        _sampled.add(timer)
+        if _sampler is None:
+            _sampler = threading.Thread(target=sample_rss, daemon=True)
+            _sampler.start()
+
+
+class StageTimer:
+    # sums the seconds per stage, also of stages timed in writer threads or merged from worker processes. it times
+    # when it has a log to write to, or with timed=True for a worker that returns its stages to the timer of the run
+    def __init__(self, log_file=None, timed=None, **record):
+        self.log_file = log_file
+        self.timed = log_file is not None if timed is None else timed
+        self.record = record
+        self.stages = {}
+        self.peak_rss = None
+        self.lock = threading.Lock()
+        self.start = time.perf_counter()
+        if self.timed:
+            self.add_peak(current_rss_mb())
+            start_sampling(self)
+
+    @contextmanager
+    def stage(self, name):
+        if not self.timed:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add({name: time.perf_counter() - start})
+            self.add_peak(current_rss_mb())
+
+    def add(self, stages):
+        if not stages:
+            return
+        with self.lock:
+            for name, seconds in stages.items():
+                self.stages[name] = self.stages.get(name, 0) + seconds
+
+    def add_peak(self, rss):
+        # the peak memory in MB of this run so far, also of the worker processes that return theirs
+        if rss is None:
+            return
+        with self.lock:
+            self.peak_rss = rss if self.peak_rss is None else max(self.peak_rss, rss)
+
+    def stop(self):
+        # stops sampling the memory and returns the peak
+        with _sampler_lock:
+            _sampled.discard(self)
+        if self.timed:
+            self.add_peak(current_rss_mb())
+        return self.peak_rss
+
+    def write(self):
+        # appends the record of this run to the log, each record with a single write so parallel workers do not interleave
+        if self.log_file is None:
+            return
+        peak_rss = self.stop()
+        record = {"time": datetime.now().isoformat(timespec="seconds"), **self.record,
+                  "stages": {name: round(seconds, 4) for name, seconds in self.stages.items()},
+                  "total": round(time.perf_counter() - self.start, 4), "peak_rss_mb": round(peak_rss, 1) if peak_rss is not None else None}
+        if self.log_file.endswith(".csv"):
+            rows = [{"time": record["time"], "script": record.get("script"), "tile": record.get("tile"),
+                     "dates": " ".join(str(date) for date in record.get("dates", [])), "stage": stage,
+                     "seconds": seconds, "peak_rss_mb": record["peak_rss_mb"]}
+                    for stage, seconds in list(record["stages"].items()) + [("total", record["total"])]]
+            text = io.StringIO()
+            writer = csv.DictWriter(text, fieldnames=CSV_FIELDS, lineterminator="\n")
+            if not os.path.isfile(self.log_file):
+                writer.writeheader()
+            writer.writerows(rows)
+            text = text.getvalue()
+        else:
+            text = json.dumps(record) + "\n"
+        with open(self.log_file, "a") as file:
+            file.write(text)
+
+
+def stage_timer(log_file=None, **record):
+    # the timer of one run, timing only when a log is given here or in the IA_PROFILE_LOG environment variable
+    return StageTimer(log_file or os.environ.get(PROFILE_LOG_ENV) or None, **record)
+
+
+# the timer of the functions that are called without one
+NO_TIMER = StageTimer()
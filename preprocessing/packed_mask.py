@@ -0,0 +1,169 @@
+import numpy as np
+from rasterio.windows import Window
+from block_reduce import block_factors, block_reduce
+
+# boolean rasters (forest, edge and loss masks) with one bit per pixel instead of a byte (bool, uint8) or eight
+# (np.where(..., 1, 0) is int64): every row is packed with np.packbits into bytes, the first pixel in the highest
+# bit, so a 40000 x 40000 Hansen tile mask takes 200 MB. the bits beyond the width in the last byte of a row are
+# always 0. erosion and neighbour counts shift whole rows of bytes and combine them bitwise, block sums count the
+# bits with a table per byte, so the masks are only unpacked a strip of rows at a time to be written
+
+DEFAULT_STRIP_ROWS = 1024
+# the number of set bits of every byte
+POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1).astype(np.uint8)
+
+
+def structure_offsets(structure):
+    # the (row, col) offsets from the centre of the nonzero elements of a structure or kernel
+    structure = np.asarray(structure)
+    centre_y, centre_x = structure.shape[0] // 2, structure.shape[1] // 2
+    return [(int(row) - centre_y, int(col) - centre_x) for row, col in zip(*np.nonzero(structure))]
+
+
+class PackedMask:
+    def __init__(self, words, width):
+        # words: uint8 array of (rows, ceil(width / 8)) packed rows
+        self.words = words
+        self.width = width
+
+    @classmethod
+    def zeros(cls, shape):
+        return cls(np.zeros((shape[0], -(-shape[1] // 8)), dtype=np.uint8), shape[1])
+
+    @classmethod
+    def from_array(cls, mask, strip_rows=DEFAULT_STRIP_ROWS):
+        # packs anything that is nonzero, strip by strip so a uint8 or int64 mask is not copied as bool at once
+        mask = np.asarray(mask)
+        packed = cls.zeros(mask.shape)
+        for first in range(0, mask.shape[0], strip_rows):
+            packed.words[first:first + strip_rows] = np.packbits(mask[first:first + strip_rows] != 0, axis=1)
+        return packed
+
+    @classmethod
+    def read(cls, src, condition, band=1, strip_rows=DEFAULT_STRIP_ROWS):
+        # the mask condition(values) of a band of an open raster, read a strip of rows at a time
+        packed = cls.zeros((src.height, src.width))
+        for first in range(0, src.height, strip_rows):
+            rows = min(strip_rows, src.height - first)
+            values = src.read(band, window=Window(0, first, src.width, rows))
+            packed.words[first:first + rows] = np.packbits(condition(values), axis=1)
+        return packed
+
+    @property
+    def shape(self):
+        return self.words.shape[0], self.width
+
+    @property
+    def nbytes(self):
+        return self.words.nbytes
+
+    def padding(self):
+        # the bits of the last byte of a row that are pixels
+        return np.uint8((0xFF << (-self.width % 8)) & 0xFF)
+
+    def new(self, words):
+        words[:, -1] &= self.padding()
+        return PackedMask(words, self.width)
+
+    def __and__(self, other):
+        return PackedMask(self.words & other.words, self.width)
+
+    def __or__(self, other):
+        return PackedMask(self.words | other.words, self.width)
+
+    def __xor__(self, other):
+        return PackedMask(self.words ^ other.words, self.width)
+
+    def __invert__(self):
+        return self.new(~self.words)
+
+    def unpack(self, first=0, last=None):
+        # the bool mask of rows first:last
+        return np.unpackbits(self.words[first:last], axis=1, count=self.width).view(bool)
+
+    def count(self):
+        return int(POPCOUNT[self.words].sum(dtype=np.int64))
+
+    def shifted(self, row_offset, col_offset):
+        # the mask at (row + row_offset, col + col_offset) of every pixel, 0 beyond the raster
+        height, nwords = self.words.shape
+        words = np.zeros_like(self.words)
+        if abs(row_offset) >= height or abs(col_offset) >= self.width:
+            return PackedMask(words, self.width)
+        rows = self.words[max(0, row_offset):height + min(0, row_offset)]
+        target = words[max(0, -row_offset):height + min(0, -row_offset)]
+        byte_offset, bit_offset = divmod(abs(col_offset), 8)
+        # the rows with a zero byte on both sides, so the bytes next to the shifted ones are 0 beyond the raster
+        padded = np.zeros((rows.shape[0], nwords + 2 * (byte_offset + 1)), dtype=np.uint8)
+        padded[:, byte_offset + 1:byte_offset + 1 + nwords] = rows
+        start = byte_offset + 1 + (byte_offset if col_offset > 0 else -byte_offset)
+        target[:] = padded[:, start:start + nwords]
+        if bit_offset:
+            if col_offset > 0:
+                # the next pixels are in the lower bits and the highest bits of the next byte
+                target <<= bit_offset
+                target |= padded[:, start + 1:start + 1 + nwords] >> (8 - bit_offset)
+            else:
+                target >>= bit_offset
+                target |= padded[:, start - 1:start - 1 + nwords] << (8 - bit_offset)
+        return self.new(words)
+
+    def erode(self, structure):
+        # like scipy.ndimage.binary_erosion(mask, structure) with border_value 0: the pixels that have the mask at
+        # every nonzero element of structure around them, also when the centre of structure is 0
+        eroded = None
+        for row_offset, col_offset in structure_offsets(structure):
+            neighbour = self.shifted(row_offset, col_offset)
+            eroded = neighbour if eroded is None else eroded & neighbour
+        return eroded if eroded is not None else self.new(np.full_like(self.words, 0xFF))
+
+    def count_at_least(self, kernel, minimum):
+        # like scipy.ndimage.convolve(mask, kernel, mode='constant', cval=0) >= minimum for a kernel of zeros and
+        # ones. at_least[n] holds the pixels with at least n of the neighbours seen so far
+        if minimum <= 0:
+            return self.new(np.full_like(self.words, 0xFF))
+        at_least = [None] * (minimum + 1)
+        for row_offset, col_offset in structure_offsets(kernel):
+            # convolve mirrors the kernel
+            neighbour = self.shifted(-row_offset, -col_offset).words
+            for n in range(minimum, 1, -1):
+                if at_least[n - 1] is not None:
+                    both = at_least[n - 1] & neighbour
+                    at_least[n] = both if at_least[n] is None else at_least[n] | both
+            at_least[1] = neighbour.copy() if at_least[1] is None else at_least[1] | neighbour
+        if at_least[minimum] is None:
+            return PackedMask.zeros(self.shape)
+        return PackedMask(at_least[minimum], self.width)
+
+    def zero_border(self):
+        # the mask without its outer rows and columns
+        words = self.words.copy()
+        words[[0, -1]] = 0
+        words[:, 0] &= 0x7F
+        last_byte, last_bit = divmod(self.width - 1, 8)
+        words[:, last_byte] &= np.uint8(~(0x80 >> last_bit) & 0xFF)
+        return PackedMask(words, self.width)
+
+    def block_sum(self, factor, strip_blocks=64):
+        # the number of pixels in the mask per block of factor (an int or (rows, cols)) pixels, partial blocks at the
+        # end summed over what they have. when the block width is whole bytes the bytes are counted directly
+        factor_y, factor_x = block_factors(factor)
+        sums = []
+        for first in range(0, self.words.shape[0], factor_y * strip_blocks):
+            last = first + factor_y * strip_blocks
+            if factor_x % 8 == 0:
+                sums.append(block_reduce(POPCOUNT[self.words[first:last]], (factor_y, factor_x // 8), "sum", partial=True))
+            else:
+                sums.append(block_reduce(self.unpack(first, last), (factor_y, factor_x), "sum", partial=True))
+        return np.concatenate(sums, axis=0)
+
+    def fill(self, array, value, strip_rows=DEFAULT_STRIP_ROWS):
+        # sets array to value where the mask is set, a strip of rows at a time
+        for first in range(0, self.words.shape[0], strip_rows):
+            array[first:first + strip_rows][self.unpack(first, first + strip_rows)] = value
+
+    def write(self, dst, band=1, dtype=np.uint8, strip_rows=DEFAULT_STRIP_ROWS):
+        # writes the mask as 0 and 1 to a band of an open raster, a strip of rows at a time
+        for first in range(0, self.words.shape[0], strip_rows):
+            rows = self.unpack(first, first + strip_rows)
+            dst.write(rows.astype(dtype), band, window=Window(0, first, self.width, rows.shape[0]))
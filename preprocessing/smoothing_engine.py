@@ -0,0 +1,91 @@
+import functools
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+from scipy import fft
+from scipy.ndimage import convolve
+from tile_halo import halo_window, read_mosaic_window
+
+# shared weighted distance smoothing for the IA features (31x31, 1/(1+d^1.5), lowest 17% of the weights cut)
+# and the smoothing scripts (21x21, 1/(1+d)). small images or kernels use the direct convolution, everything
+# else an FFT with a cached kernel spectrum. both equal convolve(..., mode='constant', cval=0.0) up to
+# floating point rounding and return the dtype of the input, like scipy.ndimage.convolve does
+
+# below this number of nonzero kernel weights or output pixels the direct convolution is faster
+DIRECT_MAX_WEIGHTS = 64
+DIRECT_MAX_PIXELS = 64 * 64
+# rows per strip when smoothing a raster from disk
+DEFAULT_STRIP_ROWS = 1024
+
+
+@functools.lru_cache(maxsize=None)
+def smoothing_kernel(window_size, exponent=1.0, quantile=None):
+    # Create a weighted distance matrix
+    x, y = np.meshgrid(np.arange(window_size), np.arange(window_size))
+    distance = np.sqrt((x - window_size // 2)**2 + (y - window_size // 2)**2)
+    weight = 1.0 / (1.0 + distance**exponent)  # Weighted distance
+    if quantile is not None:
+        threshold = np.quantile(weight, quantile)
+        weight[weight < threshold] = 0
+    # Normalize the weights
+    weight /= weight.sum()
+    weight.setflags(write=False)
+    return weight
+
+
+def fft_shape(shape, window_size):
+    # the padded size that turns the circular FFT convolution into the linear one with zeros outside the image
+    return tuple(fft.next_fast_len(size + window_size - 1, real=True) for size in shape)
+
+
+@functools.lru_cache(maxsize=16)
+def kernel_spectrum(window_size, exponent, quantile, shape):
+    return fft.rfft2(smoothing_kernel(window_size, exponent, quantile), s=shape)
+
+
+def choose_method(shape, window_size, exponent=1.0, quantile=None):
+    weights = np.count_nonzero(smoothing_kernel(window_size, exponent, quantile))
+    # the FFT crop below assumes the kernel has a center pixel
+    if window_size % 2 == 0 or weights <= DIRECT_MAX_WEIGHTS or shape[0] * shape[1] <= DIRECT_MAX_PIXELS:
+        return "direct"
+    return "fft"
+
+
+def fft_smoothing(data, window_size, exponent=1.0, quantile=None):
+    shape = fft_shape(data.shape, window_size)
+    spectrum = kernel_spectrum(window_size, exponent, quantile, shape)
+    full = fft.irfft2(fft.rfft2(data, s=shape) * spectrum, s=shape)
+    half = window_size // 2
+    smoothed = full[half:half + data.shape[0], half:half + data.shape[1]]
+    # the FFT leaves rounding noise where the direct convolution is exactly zero (no data within the window)
+    smoothed[np.abs(smoothed) < 1e-10 * np.abs(data).max(initial=0)] = 0
+    return smoothed
+
+
+def weighted_smoothing(data, window_size, exponent=1.0, quantile=None, method="auto"):
+    data = np.nan_to_num(data)
+    if method == "auto":
+        method = choose_method(data.shape, window_size, exponent, quantile)
+    if method == "direct":
+        return convolve(data, smoothing_kernel(window_size, exponent, quantile), mode='constant', cval=0.0)
+    smoothed = fft_smoothing(data.astype(np.float64), window_size, exponent, quantile)
+    return smoothed.astype(data.dtype) if data.dtype != np.float64 else smoothed
+
+
+def smooth_raster(input_file, output_file, window_size, exponent=1.0, quantile=None, nodata_to_zero=False, strip_rows=DEFAULT_STRIP_ROWS, neighbours=False):
+    # smooths a single band raster strip by strip, every strip is read with a window_size//2 halo on all sides
+    # so the result is the same as smoothing the whole raster at once, without loading it whole. outside the
+    # raster the halo is zero, or with neighbours taken from the neighbouring tiles (see tile_halo.py)
+    half = window_size // 2
+    with rasterio.open(input_file) as src:
+        profile = src.profile
+        nodata = src.nodata
+        profile.update(dtype=rasterio.float32, count=1)
+        with rasterio.open(output_file, 'w', **profile) as dst:
+            for row_off in range(0, src.height, strip_rows):
+                nrows = min(strip_rows, src.height - row_off)
+                data = read_mosaic_window(input_file, halo_window(Window(0, row_off, src.width, nrows), half), neighbours=neighbours)
+                if nodata_to_zero and nodata is not None:
+                    data[data == nodata] = 0
+                smoothed = weighted_smoothing(data, window_size, exponent, quantile)
+                dst.write(smoothed[half:half + nrows, half:half + src.width].astype(np.float32), 1, window=Window(0, row_off, src.width, nrows))
@@ -0,0 +1,56 @@
+import os
+import re
+from calendar import monthrange
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+
+# the tile and date that name every layer of the preprocessed tree, <prep_folder>/<input|groundtruth>/<tile>/<tile>_<date>_<layer>.tif.
+# the paths of the layers of a date, and of the groundtruth of the earlier dates, are built from this key instead of
+# replacing parts of the path of another layer, which also hit folder names that happen to contain "input" or "layer"
+
+# the relative dates are days since 2015-01-01, the same origin as the integrated alerts
+ORIGIN = date(2015, 1, 1)
+LAYER_FILE = re.compile(r"^(\d{2}[NS]_\d{3}[EW])_(\d{4}-\d{2}-\d{2})_([A-Za-z0-9]+)\.tif$")
+
+
+class TileDate(namedtuple("TileDate", ["tile", "date"])):
+    # a tile id like 00N_070W with a datetime.date
+    __slots__ = ()
+
+    @classmethod
+    def from_string(cls, tile, date_str):
+        return cls(tile, datetime.strptime(date_str, "%Y-%m-%d").date())
+
+    @classmethod
+    def from_relative_date(cls, tile, relative_date):
+        return cls(tile, ORIGIN + timedelta(days=int(relative_date)))
+
+    @property
+    def relative_date(self):
+        return (self.date - ORIGIN).days
+
+    @property
+    def date_string(self):
+        return self.date.strftime("%Y-%m-%d")
+
+    def shifted(self, months):
+        # the same day months later (or earlier when negative), clipped to the end of shorter months like relativedelta
+        month = self.date.month - 1 + months
+        year, month = self.date.year + month // 12, month % 12 + 1
+        return TileDate(self.tile, self.date.replace(year=year, month=month, day=min(self.date.day, monthrange(year, month)[1])))
+
+    def file_name(self, layer):
+        return f"{self.tile}_{self.date_string}_{layer}.tif"
+
+    def layer_path(self, prep_folder, layer):
+        folder = "groundtruth" if layer.startswith("groundtruth") else "input"
+        return os.path.join(prep_folder, folder, self.tile, self.file_name(layer))
+
+
+def parse_layer_path(path):
+    # splits <prep_folder>/input/<tile>/<tile>_<date>_<layer>.tif into the preprocessed folder, its key and the layer
+    match = LAYER_FILE.match(os.path.basename(path))
+    if match is None:
+        raise ValueError(f"{path} is not named <tile>_<yyyy-mm-dd>_<layer>.tif")
+    prep_folder = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(path))))
+    return prep_folder, TileDate.from_string(match.group(1), match.group(2)), match.group(3)
@@ -0,0 +1,76 @@
+import os
+import re
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+
+# reads windows that reach beyond a 10x10 degree tile by filling the part outside the tile from the neighbouring
+# tiles. the neighbours are found by their tile id (e.g. 00N_010E, the top left corner of the tile) in the same
+# folder and with the same file name otherwise. only the pixels in the window are read, never whole neighbours
+
+TILE_ID = re.compile(r"(\d{2})([NS])_(\d{3})([EW])")
+TILE_DEGREES = 10
+
+
+def parse_tile_id(tile_id):
+    # returns the latitude of the top and the longitude of the left side of the tile
+    lat, north, lon, east = TILE_ID.fullmatch(tile_id).groups()
+    return int(lat) * (1 if north == "N" else -1), int(lon) * (1 if east == "E" else -1)
+
+
+def format_tile_id(top, left):
+    return f"{abs(top):02d}{'N' if top >= 0 else 'S'}_{abs(left):03d}{'E' if left >= 0 else 'W'}"
+
+
+def neighbour_path(path, rows, cols):
+    # the file of the tile rows tiles south and cols tiles east of the tile in path, or None without a tile id.
+    # there are no neighbours across the poles or the antimeridian
+    dir_name, file_name = os.path.split(path)
+    match = TILE_ID.search(file_name)
+    if match is None:
+        return None
+    top, left = parse_tile_id(match.group(0))
+    top, left = top - rows * TILE_DEGREES, left + cols * TILE_DEGREES
+    if not (-90 < top <= 90 and -180 <= left < 180):
+        return None
+    return os.path.join(dir_name, file_name[:match.start()] + format_tile_id(top, left) + file_name[match.end():])
+
+
+def neighbour_paths(path):
+    # the existing files of the eight neighbouring tiles
+    paths = []
+    for rows in [-1, 0, 1]:
+        for cols in [-1, 0, 1]:
+            if rows == 0 and cols == 0:
+                continue
+            neighbour = neighbour_path(path, rows, cols)
+            if neighbour is not None and os.path.isfile(neighbour):
+                paths.append(neighbour)
+    return paths
+
+
+def read_mosaic_window(path, window, band=1, neighbours=True):
+    # reads a window given in the pixel coordinates of the tile in path, which may reach outside the tile.
+    # the neighbouring tiles must share the pixel grid of the tile, pixels without a tile are zero
+    with rasterio.open(path) as src:
+        transform = src.transform
+        dtype = src.dtypes[band - 1]
+    row_off, col_off = int(window.row_off), int(window.col_off)
+    height, width = int(window.height), int(window.width)
+    mosaic = np.zeros((height, width), dtype=dtype)
+    for source in [path] + (neighbour_paths(path) if neighbours else []):
+        with rasterio.open(source) as src:
+            # position of this tile in the pixels of the tile in path
+            source_row = int(round((transform.f - src.transform.f) / -transform.e))
+            source_col = int(round((src.transform.c - transform.c) / transform.a))
+            first_row, last_row = max(row_off, source_row), min(row_off + height, source_row + src.height)
+            first_col, last_col = max(col_off, source_col), min(col_off + width, source_col + src.width)
+            if first_row >= last_row or first_col >= last_col:
+                continue
+            mosaic[first_row - row_off:last_row - row_off, first_col - col_off:last_col - col_off] = src.read(
+                band, window=Window(first_col - source_col, first_row - source_row, last_col - first_col, last_row - first_row))
+    return mosaic
+
+
+def halo_window(window, halo):
+    return Window(int(window.col_off) - halo, int(window.row_off) - halo, int(window.width) + 2 * halo, int(window.height) + 2 * halo)
@@ -1,67 +1,66 @@
 import os
+import sys
 import numpy as np
 import rasterio
-from queue import Queue
-
-def radial_distance_search(data, start_point):
-    print(f"Starting radial search from center at {start_point}")
-    queue = Queue()
-    queue.put((start_point[0], start_point[1], 0))  # (x, y, distance)
-    visited = set(start_point)
-    directions = [(1, 0), (-1, 0), (0, 1), (0, -1)]  # 4-connectivity
-
-    while not queue.empty():
-        x, y, dist = queue.get()
-        for dx, dy in directions:
-            nx, ny = x + dx, y + dy
-            if 0 <= nx < data.shape[0] and 0 <= ny < data.shape[1] and (nx, ny) not in visited:
-                visited.add((nx, ny))
-                if data[nx, ny] == 0:  # Edge found
-                    print(f"Edge found at {nx, ny} with distance {dist + 1}")
-                    return dist + 1
-                queue.put((nx, ny, dist + 1))
-    print(f"No edge found from center at {start_point}")
-    return np.inf  # If no edge is found
+from rasterio.windows import Window
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "preprocessing"))
+from distance_engine import distance_strips
 
 def calculate_and_resample_distance(src_path, output_path, target_resolution=(0.004, 0.004)):
+    # the distance in pixels from the centre of every target_resolution cell to the nearest pixel outside the mask,
+    # counted in 4-connected steps, on the grid of the cells. it is the shortest path through one of the four neighbours
+    # of the centre, so a centre outside the mask is 1 next to another such pixel and 2 otherwise. the steps of all
+    # pixels come from one taxicab distance transform, streamed strip by strip (see distance_engine.py), instead of a
+    # search from every centre. inf where the tile has no pixel outside the mask
     print(f"Processing {src_path}")
     with rasterio.open(src_path) as src:
-        data = src.read(1)
-        
-        # Handling no-data values and NaNs
         nodata = src.nodata
-        if nodata is not None:
-            data[data == nodata] = 0
-        data[np.isnan(data)] = 0
-        
-        # Creating binary mask where non-forest is 0 (background)
-        mask = data > 0
-        print("Binary mask created, calculating distances...")
+        step_y, step_x = int(round(target_resolution[1] / src.res[1])), int(round(target_resolution[0] / src.res[0]))
+
+        def read_background(first, last):
+            # non-forest is 0 (background), like no-data and NaN
+            data = src.read(1, window=Window(0, first, src.width, last - first))
+            background = ~(data > 0)
+            if nodata is not None:
+                background |= data == nodata
+            return background
+
+        center_rows = np.arange(step_y // 2, src.height, step_y)
+        center_cols = np.arange(step_x // 2, src.width, step_x)
+        distance_map = np.full((len(center_rows), len(center_cols)), np.inf, dtype=np.float32)
+        # the steps of the rows block_first onwards, starting with an inf row above the raster
+        block, block_first, done = np.full((1, src.width), np.inf, dtype=np.float32), -1, 0
+        for first, steps in distance_strips(read_background, 0, src.height, metric='taxicab'):
+            if steps is None:
+                break
+            # the last two rows of the block and the strip, and an inf row below the raster after the last strip
+            rows = [block[-2:], steps.astype(np.float32)]
+            if first + len(steps) == src.height:
+                rows.append(np.full((1, src.width), np.inf, dtype=np.float32))
+            block_first, block = first - len(rows[0]), np.vstack(rows)
+            # the centres with the rows above and below them in the block
+            ready = center_rows[done:][center_rows[done:] + 1 < block_first + len(block)]
+            if len(ready) == 0:
+                continue
+            steps = np.pad(block, ((0, 0), (1, 1)), constant_values=np.inf)
+            rows, cols = ready[:, None] - block_first, center_cols[None, :] + 1
+            neighbours = np.minimum.reduce([steps[rows - 1, cols], steps[rows + 1, cols], steps[rows, cols - 1], steps[rows, cols + 1]])
+            distance_map[done:done + len(ready)] = neighbours + 1
+            done += len(ready)
 
-        # Set up metadata for output
         meta = src.meta.copy()
         meta.update({
             'dtype': 'float32',
             'compress': 'lzw',
             'count': 1,
+            'width': distance_map.shape[1],
+            'height': distance_map.shape[0],
+            'transform': src.transform * src.transform.scale(step_x, step_y),
         })
-
-        # Prepare distance map
-        distance_map = np.full(data.shape, np.inf, dtype=np.float32)
-
-        # Assume grid cells are 400x400m, define centers accordingly
-        step_x, step_y = int(400 / src.res[0]), int(400 / src.res[1])
-        centers = [(x, y) for x in range(step_x//2, data.shape[0], step_x)
-                          for y in range(step_y//2, data.shape[1], step_y)]
-
-        # Calculate distance from each center
-        for center in centers:
-            distance_map[center] = radial_distance_search(mask, center)
-
-        print(f"Distances calculated, saving to {output_path}")
-        with rasterio.open(output_path, 'w', **meta) as dst:
-            dst.write(distance_map, 1)
-        print(f"Saved resampled distance map to {output_path}")
+    print(f"Distances calculated, saving to {output_path}")
+    with rasterio.open(output_path, 'w', **meta) as dst:
+        dst.write(distance_map, 1)
+    print(f"Saved resampled distance map to {output_path}")
 
 # Example paths setup
 src_directory = "D:/temp/NewDatasetsStijn/Forest edge/EdgeMaps2"
@@ -1,35 +1,25 @@
 import os
+import sys
 import numpy as np
 import rasterio
-from rasterio.enums import Resampling
-from rasterio.warp import calculate_default_transform, reproject
+from rasterio.warp import calculate_default_transform
+# the shared block reduction of the preprocessing folder
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "preprocessing"))
+from block_reduce import upsampled_block_sum
 
 def sum_high_res_values(src_path, output_path, high_res=(0.0004, 0.0004), final_res=(0.004, 0.004)):
     print(f"Processing {src_path}")
     with rasterio.open(src_path) as src:
         meta = src.meta.copy()
         src_bounds = src.bounds
-        src_transform = src.transform
 
-        # Calculate the new transformation and dimensions for high resolution
+        # Calculate the dimensions of the high resolution grid, the nearest neighbour resampling to it is not made:
+        # its block sums are taken from the source pixels directly (see block_reduce.upsampled_block_sum)
         high_transform, high_width, high_height = calculate_default_transform(
             src.crs, src.crs, src.width, src.height, *src_bounds,
             resolution=high_res
         )
-        
-        # Create an empty array for high resolution
-        high_res_data = np.zeros((high_height, high_width), dtype=src.meta['dtype'])
-        
-        # Reproject to high resolution using nearest neighbor
-        reproject(
-            source=rasterio.band(src, 1),
-            destination=high_res_data,
-            src_transform=src_transform,
-            src_crs=src.crs,
-            dst_transform=high_transform,
-            dst_crs=src.crs,
-            resampling=Resampling.nearest
-        )
+        data = src.read(1)
 
         # Calculate the transformation and dimensions for final resolution
         final_transform, final_width, final_height = calculate_default_transform(
@@ -44,11 +34,10 @@ def sum_high_res_values(src_path, output_path, high_res=(0.0004, 0.0004), final_
         step_y = int(final_res[1] / high_res[1])
         step_x = int(final_res[0] / high_res[0])
         
-        for i in range(final_height):
-            for j in range(final_width):
-                vertical_slice = slice(i * step_y, min((i + 1) * step_y, high_height))
-                horizontal_slice = slice(j * step_x, min((j + 1) * step_x, high_width))
-                final_data[i, j] = np.sum(high_res_data[vertical_slice, horizontal_slice])
+        # every output cell is the sum of its block of high resolution pixels, blocks at the edge are summed over what they have
+        sums = upsampled_block_sum(data, (src.res[1] / high_res[1], src.res[0] / high_res[0]), (step_y, step_x), (high_height, high_width))
+        rows, cols = min(final_height, sums.shape[0]), min(final_width, sums.shape[1])
+        final_data[:rows, :cols] = sums[:rows, :cols]
 
         # Remove the outermost right column of pixels
         final_data = final_data[:, :-1]
@@ -1,34 +1,25 @@
 
 import os
+import sys
 import numpy as np
 import rasterio
-from rasterio.enums import Resampling
-from rasterio.warp import calculate_default_transform, reproject
+from rasterio.warp import calculate_default_transform
+# the shared block reduction of the preprocessing folder
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "preprocessing"))
+from block_reduce import upsampled_block_sum
 
 def count_high_res_edges(src_path, output_path, high_res=(0.0001, 0.0001), final_res=(0.004, 0.004)):
     print(f"Processing {src_path}")
     with rasterio.open(src_path) as src:
         meta = src.meta.copy()
 
-        # Calculate the new transformation and dimensions for high resolution
+        # Calculate the dimensions of the high resolution grid, the nearest neighbour resampling to it is not made:
+        # its block sums are taken from the source pixels directly (see block_reduce.upsampled_block_sum)
         high_transform, high_width, high_height = calculate_default_transform(
             src.crs, src.crs, src.width, src.height, *src.bounds,
             resolution=high_res
         )
-        
-        # Create an empty array for high resolution
-        high_res_data = np.zeros((high_height, high_width), dtype=src.meta['dtype'])
-        
-        # Reproject to high resolution using nearest neighbor
-        reproject(
-            source=rasterio.band(src, 1),
-            destination=high_res_data,
-            src_transform=src.transform,
-            src_crs=src.crs,
-            dst_transform=high_transform,
-            dst_crs=src.crs,
-            resampling=Resampling.nearest
-        )
+        data = src.read(1)
 
         # Calculate the transformation and dimensions for final resolution
         final_transform, final_width, final_height = calculate_default_transform(
@@ -40,11 +31,10 @@ def count_high_res_edges(src_path, output_path, high_res=(0.0001, 0.0001), final
         final_data = np.zeros((final_height, final_width), dtype=np.uint32)  # Use uint32 for counts
 
         # Aggregate high resolution data into final resolution
-        for i in range(final_height):
-            for j in range(final_width):
-                vertical_slice = slice(i * int(final_res[0] / high_res[0]), (i + 1) * int(final_res[0] / high_res[0]))
-                horizontal_slice = slice(j * int(final_res[1] / high_res[1]), (j + 1) * int(final_res[1] / high_res[1]))
-                final_data[i, j] = np.sum(high_res_data[vertical_slice, horizontal_slice])
+        # every output cell is the sum of its block of high resolution pixels, blocks at the edge are summed over what they have
+        counts = upsampled_block_sum(data, (src.res[1] / high_res[1], src.res[0] / high_res[0]), (int(final_res[0] / high_res[0]), int(final_res[1] / high_res[1])), (high_height, high_width))
+        rows, cols = min(final_height, counts.shape[0]), min(final_width, counts.shape[1])
+        final_data[:rows, :cols] = counts[:rows, :cols]
 
         # Update metadata for the output file
         meta.update({
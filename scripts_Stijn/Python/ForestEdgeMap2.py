@@ -1,12 +1,15 @@
 import os
+import sys
 import rasterio
-from scipy.ndimage import binary_erosion, convolve
-import numpy as np
+# the bit packed masks of the preprocessing folder
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "preprocessing"))
+from packed_mask import PackedMask
 
 def create_edge_map(src_path, output_path):
     print(f"Creating edge map for {src_path}")
     with rasterio.open(src_path) as src:
-        data = src.read(1)
+        # The binary map as one bit per pixel
+        data = PackedMask.read(src, lambda values: values != 0)
         meta = src.meta.copy()
 
         # Define structuring element for 4-connectivity (orthogonal neighbors only)
@@ -15,30 +18,25 @@ def create_edge_map(src_path, output_path):
                   [0, 1, 0]]
 
         # Apply binary erosion to identify potential edges
-        eroded_forest = binary_erosion(data, structure=struct)
+        eroded_forest = data.erode(struct)
         potential_edges = data & (~eroded_forest)
 
-        # Use convolution to count non-forest neighbors for each potential edge pixel
+        # Count the potential edge pixels among the neighbors of each potential edge pixel, like a convolution
         kernel = [[0, 1, 0],
                   [1, 0, 1],
                   [0, 1, 0]]
-        non_forest_neighbors = convolve(potential_edges, kernel, mode='constant', cval=0)
 
         # Define forest edge pixels as having at least two non-forest neighbors
-        edges = (non_forest_neighbors >= 2) & potential_edges
+        edges = potential_edges.count_at_least(kernel, 2) & potential_edges
 
         # Mask out the borders to avoid false edges at the raster edges
-        edges[0, :] = 0  # Top row
-        edges[-1, :] = 0  # Bottom row
-        edges[:, 0] = 0  # Left column
-        edges[:, -1] = 0  # Right column
+        edges = edges.zero_border()
 
-        # Convert edges to binary format and save
-        edges = edges.astype(rasterio.uint8)
+        # Save the edges as 0 and 1
         meta.update(dtype=rasterio.uint8, compress='lzw')
         
         with rasterio.open(output_path, 'w', **meta) as dst:
-            dst.write(edges, 1)
+            edges.write(dst)
     print(f"Edge map saved to {output_path}")
 
 binary_dir = r"D:\temp\NewDatasetsStijn\Forest edge\EdgeMaps3"
@@ -1,18 +1,21 @@
 import os
+import sys
 import numpy as np
 import rasterio
 from scipy.ndimage import distance_transform_edt, binary_erosion, generate_binary_structure
+# the bit packed masks of the preprocessing folder
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "preprocessing"))
+from packed_mask import PackedMask
 
 def create_binary_forest_map(src_path, output_path, threshold=3000):
     print(f"Creating binary forest map for {src_path}")
     with rasterio.open(src_path) as src:
-        data = src.read(1)
         meta = src.meta.copy()
-        binary_map = (data >= threshold).astype(rasterio.uint8)
+        binary_map = PackedMask.read(src, lambda data: data >= threshold)
         meta.update(dtype=rasterio.uint8, compress='lzw')  # Add LZW compression
         
         with rasterio.open(output_path, 'w', **meta) as dst:
-            dst.write(binary_map, 1)
+            binary_map.write(dst)
     print(f"Binary map saved to {output_path}")
 
 def calculate_distance_to_edge(src_path, output_path):
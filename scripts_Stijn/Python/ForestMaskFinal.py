@@ -4,17 +4,20 @@ from rasterio.warp import calculate_default_transform
 from rasterio.warp import calculate_default_transform, reproject
 import numpy as np
 import os
+import sys
 import glob
+# the bit packed masks of the preprocessing folder
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "preprocessing"))
+from packed_mask import PackedMask
 
 def adjust_forest_layers(loss_file, forestmask_file, output_dir, tile_info, target_pixel_size):
     print(f"Processing loss file: {loss_file}")
     
-    with rasterio.open(loss_file) as src_loss:
-        loss = src_loss.read(1, masked=True)
-    
     print("Classifying forest loss...")
-    loss_mask = np.where(((loss >=1) & (loss <= 23)), 1, 0)
-    print(f"Unique values in loss_mask: {np.unique(loss_mask, return_counts=True)}")
+    # one bit per pixel, read strip by strip
+    with rasterio.open(loss_file) as src_loss:
+        loss_mask = PackedMask.read(src_loss, lambda loss: (loss >= 1) & (loss <= 23))
+    print(f"Pixels in loss_mask: {loss_mask.count()} of {loss_mask.shape[0] * loss_mask.shape[1]}")
     
     # Save the classified loss mask for inspection
     loss_classified_path = os.path.join(output_dir, f"{tile_info}_loss_classified.tif")
@@ -28,9 +31,9 @@ def adjust_forest_layers(loss_file, forestmask_file, output_dir, tile_info, targ
         forest_meta = src_forestmask.meta.copy()
 
     print("Applying loss classification to forest mask...")
-    modified_forestmask = np.where(loss_mask == 1, 0, forestmask)
-    modified_forestmask = np.where(np.isnan(modified_forestmask), 0, modified_forestmask)
+    modified_forestmask = np.where(np.isnan(forestmask.data), 0, forestmask.data)
     modified_forestmask = np.multiply(modified_forestmask, 100, dtype='uint16')
+    loss_mask.fill(modified_forestmask, 0)
     
     # Set target resolution
     target_transform, target_width, target_height = calculate_default_transform(
@@ -4,15 +4,9 @@ import numpy as np
 import rasterio
 from rasterio.enums import Resampling
 from rasterio.warp import calculate_default_transform, reproject
-from scipy.ndimage import convolve
-
-def weighted_smoothing(data, window_size):
-    # Create a weighted distance matrix
-    x, y = np.meshgrid(np.arange(window_size), np.arange(window_size))
-    distance = np.sqrt((x - window_size // 2)**2 + (y - window_size // 2)**2)
-    weight = 1.0 / (1.0 + distance)  # Weighted distance
-    weight /= weight.sum()  # Normalize the weights
-    return convolve(np.nan_to_num(data), weight, mode='constant', cval=0.0)
+# the shared smoothing engine of the preprocessing folder
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "preprocessing"))
+from smoothing_engine import smooth_raster
 
 def resample_and_multiply(input_raster_path, reference_raster_path, output_raster_path):
     with rasterio.open(input_raster_path) as input_raster:
@@ -50,21 +44,8 @@ def resample_and_multiply(input_raster_path, reference_raster_path, output_raste
 
 def main(input_file, output_file):
     try:
-        with rasterio.open(input_file) as src:
-            data = src.read(1)  # Assume single-band raster
-            nodata_value = src.nodata
-            if nodata_value is not None:
-                data[data == nodata_value] = 0
-
-            smoothed_data = weighted_smoothing(data, 21)
-            profile = src.profile
-            transform = profile["transform"]
-            crs = profile["crs"]            
-            
-            profile.update(dtype=rasterio.float32, count=1)
-
-            with rasterio.open(output_file, 'w', **profile) as dst:
-                dst.write(smoothed_data, 1)
+        # nodata counts as zero, the raster is smoothed strip by strip and written as float32
+        smooth_raster(input_file, output_file, window_size=21, nodata_to_zero=True)
 
         print(f"Smoothing operation completed successfully for {os.path.basename(output_file)}.")
 
@@ -1,33 +1,13 @@
-import rasterio
-import numpy as np
-from scipy.ndimage import distance_transform_edt
 import os
+import sys
 import glob
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "preprocessing"))
+from distance_engine import closeness_raster, positive_features
 
 def distance_to_nearest_nonzero_geotiff(input_geotiff, output_geotiff):
-    with rasterio.open(input_geotiff) as src:
-        input_array = src.read(1)
-        metadata = src.profile
-
-        # Handle no-data values, NaNs, and negative values
-        if src.nodata is not None:
-            input_array[input_array == src.nodata] = 0
-        input_array[np.isnan(input_array)] = 0
-        input_array[input_array < 0] = 0  # Set negative values to zero
-
-    # Create a binary mask where zeros are treated as background and non-zeros as foreground
-    mask = input_array != 0
-    # Calculate Euclidean distance transform for non-zero (foreground) elements
-    distance_transform = distance_transform_edt(~mask)
-    # Normalize the distance transform for better visual interpretation
-    distance_transform = np.round(255 - 20 * np.log(distance_transform + 1))
-    distance_transform = np.clip(distance_transform, 0, 255)
-
-    # Update metadata for the output GeoTIFF
-    metadata.update(dtype='float32', count=1, compress='lzw')
-    # Write the distance transform array to a new GeoTIFF file
-    with rasterio.open(output_geotiff, 'w', **metadata) as dst:
-        dst.write(distance_transform.astype(rasterio.float32), 1)
+    # the closeness 255-20*ln(distance+1) to the nearest pixel above zero (no-data, NaN and negative values are not),
+    # written as uint8 strip by strip (see distance_engine.py)
+    closeness_raster(input_geotiff, output_geotiff, positive_features)
 
 # Directory containing input GeoTIFF files
 input_dir = r"D:\temp\NewDatasetsStijn\CropGrids\CropGridsResampledpertile"
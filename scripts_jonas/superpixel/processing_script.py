@@ -3,10 +3,14 @@ from rasterio.windows import Window
 import numpy as np
 import argparse
 import os
+import sys
 from datetime import datetime, timedelta
 import torch
 import torch.nn as nn
 import torch.optim as optim
+# the alert decoding of the IA preprocessing
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "preprocessing"))
+from alert_planes import load_alert_planes, split_alerts
 
 # Define the neural network architecture
 class DeforestationNet(nn.Module):
@@ -25,13 +29,9 @@ class DeforestationNet(nn.Module):
         x = self.fc2(x)
         return x
 
-def process_block(block, model, reference_date):
-    # Separate confidence and date
-    confidence = block // 10000
-    date = block % 10000
-    
+def process_block(date, confidence, model, reference_date):
     # Convert date to days since reference_date
-    days_since_reference = date - reference_date
+    days_since_reference = date.astype(np.int64) - reference_date
     
     # Normalize inputs
     confidence = confidence / 100.0  # Assuming confidence is between 0-100
@@ -46,7 +46,7 @@ def process_block(block, model, reference_date):
     
     return output.item()
 
-def process_geotiff(input_file, output_file, reference_date, model_path):
+def process_geotiff(input_file, output_file, reference_date, model_path, use_planes=False):
     # Load the trained model
     model = DeforestationNet()
     model.load_state_dict(torch.load(model_path))
@@ -63,16 +63,23 @@ def process_geotiff(input_file, output_file, reference_date, model_path):
 
         # Prepare the output array
         output_data = np.zeros((num_blocks_y, num_blocks_x), dtype=np.float32)
+        # the pre-decoded date and confidence planes of the tile (see preprocessing/alert_planes.py)
+        if use_planes:
+            date_plane, confidence_plane = load_alert_planes(input_file)
 
         # Process each 40x40 block
         for y in range(num_blocks_y):
             for x in range(num_blocks_x):
-                # Read 40x40 block
-                window = Window(x*40, y*40, 40, 40)
-                block = src.read(1, window=window)
+                # Read the date and confidence of the 40x40 block
+                if use_planes:
+                    date = date_plane[y*40:(y+1)*40, x*40:(x+1)*40]
+                    confidence = confidence_plane[y*40:(y+1)*40, x*40:(x+1)*40]
+                else:
+                    window = Window(x*40, y*40, 40, 40)
+                    date, confidence = split_alerts(src.read(1, window=window))
                 
                 # Process the block
-                result = process_block(block, model, reference_date)
+                result = process_block(date, confidence, model, reference_date)
                 
                 # Store the result
                 output_data[y, x] = result
@@ -89,10 +96,11 @@ if __name__ == "__main__":
     parser.add_argument("output_image", help="Path to the output geotiff image")
     parser.add_argument("reference_date", help="Reference date in YYYY-MM-DD format")
     parser.add_argument("model_path", help="Path to the trained model")
+    parser.add_argument("--use_planes", type=int, default=0, help="Read the memory mapped date and confidence planes of the tile (see preprocessing/alert_planes.py)")
     args = parser.parse_args()
 
     # Convert reference date to days since 2015-01-01
     reference_date = datetime.strptime(args.reference_date, "%Y-%m-%d")
     days_since_2015 = (reference_date - datetime(2015, 1, 1)).days
 
-    process_geotiff(args.input_image, args.output_image, days_since_2015, args.model_path)
\ No newline at end of file
+    process_geotiff(args.input_image, args.output_image, days_since_2015, args.model_path, use_planes=args.use_planes == 1)
\ No newline at end of file
@@ -6,7 +6,14 @@ import torch.nn as nn
 import torch.optim as optim
 from torch.utils.data import Dataset, DataLoader
 import argparse
+import os
+import sys
 from datetime import datetime, timedelta
+# the occupancy index and strip reader of the IA preprocessing
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "preprocessing"))
+from ia_cache import block_occupancy
+from ia_features import strip_windows
+from alert_planes import load_alert_planes, split_alerts
 
 # Define the neural network architecture
 class DeforestationNet(nn.Module):
@@ -36,11 +43,15 @@ class DeforestationNet(nn.Module):
 
 # Custom dataset for loading and preprocessing raster data
 class DeforestationDataset(Dataset):
-    def __init__(self, input_file, ground_truth_file, reference_date):
+    def __init__(self, input_file, ground_truth_file, reference_date, use_planes=False):
         # Open the input and ground truth raster files
         self.input_src = rasterio.open(input_file)
         self.ground_truth_src = rasterio.open(ground_truth_file)
         self.reference_date = reference_date
+        # With use_planes the blocks come from the memory mapped date and confidence planes of both files
+        self.planes = None
+        if use_planes:
+            self.planes = load_alert_planes(input_file) + load_alert_planes(ground_truth_file)[:1]
         # Calculate the number of 40x40 blocks in the raster
         self.num_blocks_x = self.input_src.width // 40
         self.num_blocks_y = self.input_src.height // 40
@@ -48,17 +59,16 @@ class DeforestationDataset(Dataset):
         # Create a list to store indices of non-zero blocks
         self.non_zero_blocks = []
         
-        # Scan the input file to find non-zero blocks
+        # Find the non-zero blocks: the occupancy index of the alert tile rules out the empty regions, the remaining
+        # row strips are read at once and checked per block
         print("Scanning input file for non-zero blocks...")
-        for y in range(self.num_blocks_y):
-            for x in range(self.num_blocks_x):
-                # Define a 40x40 window
-                window = Window(x*40, y*40, 40, 40)
-                # Read the block data
-                block = self.input_src.read(1, window=window)
-                # If any pixel in the block is non-zero, add its coordinates to the list
-                if np.any(block != 0):
-                    self.non_zero_blocks.append((x, y))
+        occupancy = block_occupancy(input_file, self.input_src)
+        for window in strip_windows(self.input_src.width, self.input_src.height, occupancy=occupancy):
+            data = self.input_src.read(1, window=window)
+            rows, cols = window.height // 40, window.width // 40
+            non_zero = np.any(data.reshape(rows, 40, cols, 40) != 0, axis=(1, 3))
+            for y, x in zip(*np.nonzero(non_zero)):
+                self.non_zero_blocks.append((int(x + window.col_off // 40), int(y + window.row_off // 40)))
         
         # Print statistics about non-zero blocks
         print(f"Found {len(self.non_zero_blocks)} non-zero blocks out of {self.num_blocks_x * self.num_blocks_y} total blocks")
@@ -72,14 +82,16 @@ class DeforestationDataset(Dataset):
         # Get the coordinates of the non-zero block
         x, y = self.non_zero_blocks[idx]
         
-        # Read 40x40 block from input
+        # Read the confidence (first digit) and date (last 4 digits) of the 40x40 block of the input
         window = Window(x*40, y*40, 40, 40)
-        input_block = self.input_src.read(1, window=window)
-
-        # Preprocess input
-        # Extract confidence (first digit) and date (last 4 digits)
-        confidence = input_block // 10000
-        date = input_block % 10000
+        if self.planes is not None:
+            date = self.planes[0][y*40:(y+1)*40, x*40:(x+1)*40].astype(np.int64)
+            confidence = self.planes[1][y*40:(y+1)*40, x*40:(x+1)*40]
+            ground_truth_date = self.planes[2][y*40:(y+1)*40, x*40:(x+1)*40].astype(np.int64)
+        else:
+            date, confidence = split_alerts(self.input_src.read(1, window=window))
+            date = date.astype(np.int64)
+            ground_truth_date = split_alerts(self.ground_truth_src.read(1, window=window))[0].astype(np.int64)
         # Calculate days since reference date
         days_since_reference = date - self.reference_date
         
@@ -90,10 +102,8 @@ class DeforestationDataset(Dataset):
         # Prepare input tensor: stack confidence and days_since_reference
         input_tensor = torch.tensor(np.stack([confidence, days_since_reference], axis=0), dtype=torch.float32)
 
-        # Read and preprocess ground truth
-        ground_truth_block = self.ground_truth_src.read(1, window=window)
         # Check if any deforestation occurs within the next 6 months (180 days)
-        future_deforestation = np.any((ground_truth_block % 10000 > date) & (ground_truth_block % 10000 <= date + 180))
+        future_deforestation = np.any((ground_truth_date > date) & (ground_truth_date <= date + 180))
         
         # Return input tensor and ground truth label
         return input_tensor, torch.tensor([float(future_deforestation)], dtype=torch.float32)
@@ -103,9 +113,9 @@ class DeforestationDataset(Dataset):
         self.input_src.close()
         self.ground_truth_src.close()
 
-def train_model(input_file, ground_truth_file, reference_date, output_model_path, epochs=10, batch_size=32):
+def train_model(input_file, ground_truth_file, reference_date, output_model_path, epochs=10, batch_size=32, use_planes=False):
     # Initialize dataset and dataloader
-    dataset = DeforestationDataset(input_file, ground_truth_file, reference_date)
+    dataset = DeforestationDataset(input_file, ground_truth_file, reference_date, use_planes)
     dataloader = DataLoader(dataset, batch_size=batch_size, shuffle=True)
 
     # Initialize model, loss function, and optimizer
@@ -153,6 +163,7 @@ if __name__ == "__main__":
     parser.add_argument("output_model", help="Path to save the trained model")
     parser.add_argument("--epochs", type=int, default=10, help="Number of training epochs")
     parser.add_argument("--batch_size", type=int, default=32, help="Batch size for training")
+    parser.add_argument("--use_planes", type=int, default=0, help="Read the memory mapped date and confidence planes of the tiles (see preprocessing/alert_planes.py)")
     args = parser.parse_args()
 
     # Convert reference date to days since 2015-01-01
@@ -161,4 +172,4 @@ if __name__ == "__main__":
 
     # Train the model
     train_model(args.input_image, args.ground_truth_image, days_since_2015, 
-                args.output_model, epochs=args.epochs, batch_size=args.batch_size)
\ No newline at end of file
+                args.output_model, epochs=args.epochs, batch_size=args.batch_size, use_planes=args.use_planes == 1)
\ No newline at end of file